@@ -0,0 +1,4 @@
+#!/bin/sh
+
+python3.6 src/index_stats.py $*
+exit $?
@@ -1,3 +1,5 @@
 pip install nltk
 pip install sortedcollections
 pip install psutil
+
+python -m nltk.downloader wordnet
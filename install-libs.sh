@@ -3,3 +3,4 @@
 pip install nltk
 pip install sortedcollections
 pip install psutil
+python -m nltk.downloader wordnet
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+
+import argparse
+import heapq
+import json
+import os.path
+import pickle
+from math import log10
+from util.snapshot import resolve_index
+from util.termdict import FrontCodedDictionary
+from util.util import PostingsListItem, encode_postings, read_token
+
+# statistics about an index, computed while streaming through it line by line:
+# * vocabulary size, number of postings and bytes per posting (as JSON and gap-compressed)
+# * distribution of the postings lengths (document frequencies) and the terms with the highest df
+# * histogram of the document lengths
+# * details about single terms (--term)
+# the text postings and the field postings (index created with --fields) are measured separately
+
+
+def dbg(*args, **kwargs):
+    if DEBUG:
+        print(*args, **kwargs)
+
+
+def log2_bucket(value: int) -> str:
+    """Name of the power-of-two bucket the value falls into (e.g. '4-7')"""
+    low  = 1 << (value.bit_length() - 1) if value > 0 else 0
+    high = 2 * low - 1 if low > 0 else 0
+    return str(low) if low == high else "%d-%d" % (low, high)
+
+
+def histogram(hist_values: dict) -> dict:
+    """Sum up the (value => count) distribution per power-of-two bucket (ordered by the buckets)"""
+    counts = {}
+    for value, count in hist_values.items():
+        counts[value.bit_length()] = counts.get(value.bit_length(), 0) + count
+    return {log2_bucket((1 << bits) >> 1): counts[bits] for bits in sorted(counts)}
+
+
+def percentile(hist_values: dict, fraction: float) -> int:
+    """Value at the fraction of the (value => count) distribution"""
+    total = sum(hist_values.values())
+    seen  = 0
+    for value in sorted(hist_values):
+        seen += hist_values[value]
+        if seen >= fraction * total:
+            return value
+    return 0
+
+
+def field_bytes(pli: PostingsListItem) -> int:
+    """Bytes of the line's field section (including the separating tab), 0 without fields"""
+    return len(pli.field_section.encode("utf8")) + 1 if pli.field_section is not None else 0
+
+
+def field_postings(pli: PostingsListItem) -> dict:
+    """The term's postings per field as PostingsListItems (field => postings)"""
+    postings = {}
+    for field, occurrences in pli.field_occurrences().items():
+        postings[field] = PostingsListItem(pli.token, [])
+        postings[field].occurrences = occurrences
+    return postings
+
+
+def term_details(pli: PostingsListItem, line: str, no_docs: int) -> dict:
+    """Statistics about a single term's postings"""
+    occurrences = list(pli.occurrences.items())
+    fields      = field_postings(pli)
+    return {"term": pli.token, "df": pli.count(), "cf": sum(pli.occurrences.values()),
+            "idf": log10(no_docs / pli.count()) if pli.count() else 0,
+            "json_bytes": len(line.encode("utf8")) - field_bytes(pli), "compressed_bytes": len(encode_postings(pli)),
+            "first_postings": occurrences[:10],
+            "fields": {field: {"df": postings.count(), "compressed_bytes": len(encode_postings(postings))}
+                       for field, postings in fields.items()},
+            "field_json_bytes": field_bytes(pli)}
+
+
+def find_term(index_file: str, term: str):
+    """Find the term's line in the index (via the term dictionary, if there is one)"""
+    if os.path.isfile(index_file + ".dict"):
+        with FrontCodedDictionary(index_file + ".dict") as term_dict:
+            offset = term_dict.get(term)
+        if offset is None:
+            return None
+        with open(index_file, "rb") as idx_file:
+            idx_file.seek(offset)
+            return idx_file.readline().decode("utf8").strip()
+
+    with open(index_file, "r") as idx_file:
+        for line in idx_file:
+            if line.strip() and read_token(line) == term:
+                return line.strip()
+    return None
+
+
+def collect_statistics(index_file: str, idx_meta, top: int) -> dict:
+    """Stream through the index once and collect the statistics"""
+    df_counts        = {}  # dict: df => number of terms
+    top_terms        = []  # heap of (df, term)
+    vocabulary       = 0
+    postings         = 0
+    occurrences      = 0
+    json_bytes       = 0
+    compressed_bytes = 0
+    fields           = {}  # dict: field => {postings, compressed_bytes}
+    field_json_bytes = 0
+
+    with open(index_file, "r") as idx_file:
+        for line in idx_file:
+            if not line.strip():
+                continue
+
+            pli = PostingsListItem.from_json(line.strip())
+            df  = pli.count()
+            vocabulary       += 1
+            postings         += df
+            occurrences      += sum(pli.occurrences.values())
+            json_bytes       += len(line.encode("utf8")) - field_bytes(pli)
+            compressed_bytes += len(encode_postings(pli))
+            if pli.field_section is not None:
+                field_json_bytes += field_bytes(pli)
+                for field, field_pli in field_postings(pli).items():
+                    field_stats = fields.setdefault(field, {"postings": 0, "compressed_bytes": 0})
+                    field_stats["postings"]         += field_pli.count()
+                    field_stats["compressed_bytes"] += len(encode_postings(field_pli))
+            if df:
+                # (terms only occurring in a field have no text postings)
+                df_counts[df] = df_counts.get(df, 0) + 1
+
+            if len(top_terms) < top:
+                heapq.heappush(top_terms, (df, pli.token))
+            elif df > top_terms[0][0]:
+                heapq.heapreplace(top_terms, (df, pli.token))
+
+            if vocabulary % 10000 == 0:
+                dbg("%d terms read" % vocabulary)
+
+    doc_lengths = idx_meta.document_lengths
+    length_hist = {}
+    for length in doc_lengths:
+        length_hist[length] = length_hist.get(length, 0) + 1
+
+    files = {}
+    for suffix in ["", ".meta", ".dict", ".fwd", ".docs"]:
+        if os.path.isfile(index_file + suffix):
+            files[os.path.basename(index_file + suffix)] = os.path.getsize(index_file + suffix)
+
+    return {
+        "index": index_file,
+        "files": files,
+        "options": {"special_strings": idx_meta.special_strings, "case_folding": idx_meta.case_folding,
+                    "stop_words": idx_meta.stop_words, "lemmatization": idx_meta.lemmatization,
+                    "stemming": idx_meta.stemming, "fields": sorted(getattr(idx_meta, "field_lengths", {}))},
+        "documents": len(doc_lengths),
+        "vocabulary": vocabulary,
+        "postings": postings,
+        "tokens": occurrences,
+        "bytes_per_posting": json_bytes / max(postings, 1),
+        "compressed_bytes_per_posting": compressed_bytes / max(postings, 1),
+        "compression_ratio": json_bytes / max(compressed_bytes, 1),
+        "fields": fields,
+        "field_json_bytes": field_json_bytes,
+        "postings_lengths": {"mean": postings / max(vocabulary, 1), "median": percentile(df_counts, 0.5),
+                             "p90": percentile(df_counts, 0.9), "p99": percentile(df_counts, 0.99),
+                             "max": max(df_counts) if df_counts else 0,
+                             "histogram": histogram(df_counts)},
+        "top_terms": [{"term": term, "df": df} for (df, term) in sorted(top_terms, reverse=True)],
+        "document_lengths": {"mean": sum(doc_lengths) / max(len(doc_lengths), 1), "median": percentile(length_hist, 0.5),
+                             "min": min(doc_lengths) if doc_lengths else 0, "max": max(doc_lengths) if doc_lengths else 0,
+                             "histogram": histogram(length_hist)},
+    }
+
+
+def print_statistics(stats: dict) -> None:
+    """Print the statistics in a human-readable format"""
+    print("Index            : %s" % stats["index"])
+    for name, size in stats["files"].items():
+        print("  %-15s: %.2f MB" % (name, size / 1024 / 1024))
+    print("Options          : %s" % ", ".join(o for o, active in stats["options"].items() if active))
+    print("Documents        : %d" % stats["documents"])
+    print("Vocabulary       : %d terms" % stats["vocabulary"])
+    print("Postings         : %d (%d tokens)" % (stats["postings"], stats["tokens"]))
+    print("Bytes per posting: %.2f as JSON, %.2f gap-compressed (ratio %.2f)"
+          % (stats["bytes_per_posting"], stats["compressed_bytes_per_posting"], stats["compression_ratio"]))
+    if stats["fields"]:
+        field_postings_total = sum(field["postings"] for field in stats["fields"].values())
+        print("Field postings   : %.2f bytes per posting as JSON (all fields)"
+              % (stats["field_json_bytes"] / max(field_postings_total, 1)))
+        for name, field in stats["fields"].items():
+            print("  %-15s: %d, %.2f bytes per posting gap-compressed"
+                  % (name, field["postings"], field["compressed_bytes"] / max(field["postings"], 1)))
+
+    lengths = stats["postings_lengths"]
+    print("\nPostings lengths : mean %.2f, median %d, p90 %d, p99 %d, max %d"
+          % (lengths["mean"], lengths["median"], lengths["p90"], lengths["p99"], lengths["max"]))
+    for bucket, count in lengths["histogram"].items():
+        print("  %-15s: %d terms" % (bucket, count))
+
+    print("\nTop terms by df  :")
+    for entry in stats["top_terms"]:
+        print("  %-15s: %d" % (entry["term"], entry["df"]))
+
+    lengths = stats["document_lengths"]
+    print("\nDocument lengths : mean %.2f, median %d, min %d, max %d"
+          % (lengths["mean"], lengths["median"], lengths["min"], lengths["max"]))
+    for bucket, count in lengths["histogram"].items():
+        print("  %-15s: %d documents" % (bucket, count))
+
+
+# add argument parsing
+parser = argparse.ArgumentParser(description="Shows statistics about an inverted index",
+                                 epilog="Maximilian Moser and Wolfgang Weintritt, 2018")
+
+parser.add_argument("--index", "-i", help="Index to inspect, default: the published snapshot")
+parser.add_argument("--top", "-n", help="Number of terms with the highest document frequency to show", type=int, default=20)
+parser.add_argument("--term", "-t", help="Only show the statistics of this (already tokenized) term", action="append")
+parser.add_argument("--json", "-j", help="Print the statistics as JSON", action="store_true")
+parser.add_argument("--debug", "-d", help="Activate Debugging", action="store_true")
+args = parser.parse_args()
+
+index_file = resolve_index(args.index)
+top        = args.top
+terms      = args.term
+as_json    = args.json
+DEBUG      = args.debug
+
+if not os.path.isfile(index_file) or not os.path.isfile(index_file + ".meta"):
+    print("Either '%s' or '%s.meta' file could not be found! Aborting." % (index_file, index_file))
+    exit(1)
+
+with open(index_file + ".meta", "rb") as idx_meta_file:
+    idx_meta = pickle.load(idx_meta_file)
+
+if terms:
+    # per-term lookup
+    no_docs = len(idx_meta.document_lengths)
+    results = []
+    for term in terms:
+        line = find_term(index_file, term)
+        if line is None:
+            results.append({"term": term, "df": 0})
+        else:
+            results.append(term_details(PostingsListItem.from_json(line), line, no_docs))
+
+    if as_json:
+        print(json.dumps(results, indent=2))
+    else:
+        for details in results:
+            if "cf" not in details:
+                print("%s: not in the index" % details["term"])
+                continue
+            print("%s: df %d, cf %d, idf %.3f, %d bytes as JSON, %d gap-compressed"
+                  % (details["term"], details["df"], details["cf"], details["idf"],
+                     details["json_bytes"], details["compressed_bytes"]))
+            print("  first postings (doc, tf): %s" % ", ".join("(%d, %d)" % p for p in details["first_postings"]))
+            for field, field_details in details["fields"].items():
+                print("  %s: df %d, %d gap-compressed" % (field, field_details["df"], field_details["compressed_bytes"]))
+            if details["fields"]:
+                print("  field postings: %d bytes as JSON" % details["field_json_bytes"])
+    exit(0)
+
+stats = collect_statistics(index_file, idx_meta, top)
+if as_json:
+    print(json.dumps(stats, indent=2))
+else:
+    print_statistics(stats)
@@ -1,13 +1,18 @@
 #!/usr/bin/env python3
 
 import argparse
+import json
 import os
 import os.path
 import pickle
-import psutil
 import util.document as document
+from array import array
+from util.docstore import DocStoreWriter
+from util.forward import build_forward_index
+from util.snapshot import collect_garbage, current_snapshot, list_snapshots, new_snapshot, publish
+from util.termdict import build_term_dictionary
 from util.tokenize import Tokenizer
-from util.util import PostingsListItem, IndexMeta, PLIEncoder, merge_blocks
+from util.util import FIELDS, CompactPostings, IndexMeta, Vocabulary, merge_blocks, merge_blocks_parallel
 
 # support the following operations:
 # * case folding
@@ -42,6 +47,9 @@ def expand_directories(files):
 
 def create_blocks(files):
     """Split up the list of files into several chunks, according to their sizes"""
+    # psutil is only needed here, so don't import it just for printing the help
+    import psutil
+
     blocks   = []
     block    = []
     sum_size = 0
@@ -76,6 +84,49 @@ def create_blocks(files):
     return blocks
 
 
+def load_manifest(directory, files, options):
+    """Load the manifest of an interrupted run in the directory, if it was started with the same files and options"""
+    manifest_file_name = os.path.join(directory, MANIFEST)
+    if not os.path.isfile(manifest_file_name):
+        return None
+
+    with open(manifest_file_name) as manifest_file:
+        manifest = json.load(manifest_file)
+
+    if manifest["files"] != files or manifest["options"] != options:
+        return None
+
+    if manifest["completed"] and not os.path.isfile(os.path.join(directory, VOCABULARY)):
+        return None
+    for entry in manifest["completed"]:
+        if not os.path.isfile(os.path.join(directory, entry["block"])) or \
+           not os.path.isfile(os.path.join(directory, entry["meta"])):
+            # the checkpoints are incomplete (e.g. deleted block files)
+            return None
+    return manifest
+
+
+def find_interrupted_run(files, options):
+    """Find the newest unpublished snapshot with a matching manifest, returns (snapshot, manifest)"""
+    current = current_snapshot()
+    for snapshot in reversed(list_snapshots()):
+        if current is not None and os.path.basename(snapshot) <= os.path.basename(current):
+            # everything up to the published snapshot was completed
+            break
+        manifest = load_manifest(snapshot, files, options)
+        if manifest is not None:
+            return (snapshot, manifest)
+    return (None, None)
+
+
+def save_manifest(manifest):
+    """Persist the manifest, such that a crash never leaves a half-written one behind"""
+    manifest_file_name = os.path.join(out_dir, MANIFEST)
+    with open(manifest_file_name + ".tmp", "w") as manifest_file:
+        json.dump(manifest, manifest_file)
+    os.replace(manifest_file_name + ".tmp", manifest_file_name)
+
+
 # add argument parsing
 parser = argparse.ArgumentParser(description="Creates an inverted index for documents",
                                  epilog="Maximilian Moser and Wolfgang Weintritt, 2018")
@@ -88,6 +139,12 @@ parser.add_argument("--stemming", "-S", help="Stemming", action="store_true")
 parser.add_argument("--debug", "-d", help="Activate Debugging", action="store_true")
 parser.add_argument("--utf8", "-u", help="Use UTF-8 encoding instead of ISO-8859-1", action="store_true")
 parser.add_argument("--preserve-blocks", "-p", help="Preserve Block Files", action="store_true")
+parser.add_argument("--merge-processes", "-m", help="Number of processes for merging the blocks", type=int, default=1)
+parser.add_argument("--forward-index", "-f", help="Create a forward index (document => term vector)", action="store_true")
+parser.add_argument("--doc-store", "-D", help="Create a compressed document store (for showing snippets)", action="store_true")
+parser.add_argument("--resume", "-r", help="Resume an interrupted run, skipping the completed blocks", action="store_true")
+parser.add_argument("--fields", "-F", help="Index the headlines as a separate field as well (for bm25f)", action="store_true")
+parser.add_argument("--keep-snapshots", "-k", help="Number of published index snapshots to keep", type=int, default=2)
 parser.add_argument("files", metavar="FILE", nargs="+", help="File to index")
 args = parser.parse_args()
 
@@ -100,6 +157,14 @@ files    = args.files
 DEBUG    = args.debug
 encoding = "utf8" if args.utf8 else "iso-8859-1"
 preserve = args.preserve_blocks
+mergers  = args.merge_processes
+forward  = args.forward_index
+store    = args.doc_store
+resume   = args.resume
+keep     = max(args.keep_snapshots, 1)
+fields   = FIELDS if args.fields else []
+MANIFEST = "index.manifest"
+VOCABULARY = "vocabulary"
 
 # create list of files from positional arguments
 files = expand_directories(files)
@@ -110,6 +175,7 @@ dbg("Case    : %s" % case)
 dbg("Stop    : %s" % stop)
 dbg("Lemma   : %s" % lemma)
 dbg("Stemming: %s" % stemming)
+dbg("Fields  : %s" % fields)
 dbg("Files   : %s" % files)
 dbg()
 
@@ -118,17 +184,69 @@ try:
     postings_list        = {}
     document_lengths     = []
     document_set_lengths = []
+    field_lengths        = {field: [] for field in fields}
     tokenizer            = Tokenizer(case, special, stop, stemming, lemma)
     no_files             = len(files)
-    blocks               = create_blocks(files)
     block_files          = []
+    options              = {"special": special, "case": case, "stop": stop, "lemma": lemma,
+                            "stemming": stemming, "encoding": encoding, "doc_store": store, "fields": fields}
+    (out_dir, manifest)  = find_interrupted_run(files, options) if resume else (None, None)
     i                    = 0
 
+    if manifest is None:
+        if resume:
+            print("No matching manifest of an interrupted run found, starting from scratch")
+        # everything is built in a new snapshot, which is only published when complete
+        # (searches keep using the previous snapshot in the meantime)
+        out_dir   = new_snapshot()
+        # the partitioning is saved, because it depends on the currently available RAM
+        manifest   = {"files": files, "options": options, "blocks": create_blocks(files),
+                      "completed": [], "doc_store": None, "vocabulary": 0}
+        doc_store  = DocStoreWriter(os.path.join(out_dir, "index.docs")) if store else None
+        vocabulary = Vocabulary()
+    else:
+        # restore the state after the last completed block
+        print("Resuming '%s' after %d/%d completed blocks"
+              % (out_dir, len(manifest["completed"]), len(manifest["blocks"])))
+        for entry in manifest["completed"]:
+            with open(os.path.join(out_dir, entry["meta"]), "rb") as block_meta_file:
+                (block_lengths, block_set_lengths, block_doc_ids, block_field_lengths) = pickle.load(block_meta_file)
+            document_lengths    .extend(block_lengths)
+            document_set_lengths.extend(block_set_lengths)
+            for field in fields:
+                field_lengths[field].extend(block_field_lengths[field])
+            document.doc_int_ids.extend(block_doc_ids)
+            block_files.append(os.path.join(out_dir, entry["block"]))
+            i += len(manifest["blocks"][entry["number"]])
+
+        if not store:
+            doc_store = None
+        elif not manifest["completed"]:
+            doc_store = DocStoreWriter(os.path.join(out_dir, "index.docs"))
+        else:
+            # the store's state is only saved for the last completed block
+            doc_store = DocStoreWriter(os.path.join(out_dir, "index.docs"), state=manifest["doc_store"])
+
+        # the vocabulary might contain tokens of the interrupted block already
+        if manifest["completed"]:
+            vocabulary = Vocabulary.load(os.path.join(out_dir, VOCABULARY), manifest["vocabulary"])
+        else:
+            vocabulary = Vocabulary()
+
+    blocks = manifest["blocks"]
+
     # this is the SPIMI approach
     for blockno, block in enumerate(blocks):
         # work every block (could be done in parallel!)
-
-        postings_list = {}
+        if blockno < len(manifest["completed"]):
+            # the block was completed by an interrupted run already
+            continue
+
+        postings_list  = {}
+        # the postings per field (term ID => postings), besides the text
+        field_postings = {field: {} for field in fields}
+        term_ids       = vocabulary.ids
+        first_doc_id   = len(document.doc_int_ids)
         for f in block:
             # for every file in the block...
             i            += 1
@@ -150,43 +268,111 @@ try:
                 # tokenize each document
                 # and construct the association list (used for the postings list)
                 tokens = tokenizer.tokenize(doc.text)
+                for field in fields:
+                    # the fields get postings and lengths of their own, the text's postings
+                    # and lengths stay the same as in an index without fields
+                    field_text   = getattr(doc, field)
+                    field_tokens = tokenizer.tokenize(field_text) if field_text else []
+                    field_lengths[field].append(len(field_tokens))
+                    postings     = field_postings[field]
+                    for t in field_tokens:
+                        term_id = term_ids.get(t)
+                        if term_id is None:
+                            term_id = vocabulary.intern(t)
+                        if term_id in postings:
+                            postings[term_id].add_doc(doc.int_id)
+                        else:
+                            postings[term_id] = CompactPostings(term_id, [doc.int_id])
                 document_lengths     .append(len(tokens))
                 document_set_lengths.append(len(set(tokens)))
+                if doc_store is not None:
+                    doc_store.add(doc)
 
                 for t in tokens:
                     # increase the occurrences of the token in the document
-                    if t in postings_list:
-                        postings_list[t].add_doc(doc.int_id)
+                    # (the doc IDs are ascending, so the compact postings can be used)
+                    # the postings are keyed by the token's term ID, shared by all blocks
+                    term_id = term_ids.get(t)
+                    if term_id is None:
+                        term_id = vocabulary.intern(t)
+                    if term_id in postings_list:
+                        postings_list[term_id].add_doc(doc.int_id)
                     else:
-                        postings_list[t] = PostingsListItem(t, [doc.int_id])
+                        postings_list[term_id] = CompactPostings(term_id, [doc.int_id])
 
         # write the block's index to file
+        # (renamed only when complete, such that a crash never leaves a partial block)
         block_name = "block-%d" % blockno
-        with open(block_name, "w") as block_file:
-            for token in sorted(postings_list):
-                pli  = postings_list[token]
-                line = pli.to_json()
+        block_path = os.path.join(out_dir, block_name)
+        # (the lines are keyed by term ID, but ordered by token like the final index;
+        #  terms only occurring in a field get empty text postings)
+        block_terms = set(postings_list).union(*field_postings.values())
+        with open(block_path + ".tmp", "w") as block_file:
+            for term_id in sorted(block_terms, key=vocabulary.token):
+                pli  = postings_list.get(term_id) or CompactPostings(term_id)
+                line = pli.to_block_line([field_postings[field].get(term_id) for field in fields])
                 block_file.write("%s\n" % line)
+        os.replace(block_path + ".tmp", block_path)
+
+        # checkpoint: everything needed to skip this block when resuming
+        with open(block_path + ".meta", "wb") as block_meta_file:
+            pickle.dump((document_lengths[first_doc_id:], document_set_lengths[first_doc_id:],
+                         document.doc_int_ids[first_doc_id:],
+                         {field: field_lengths[field][first_doc_id:] for field in fields}), block_meta_file)
+        manifest["completed"].append({"number": blockno, "block": block_name, "meta": block_name + ".meta",
+                                      "files": block, "doc_ids": [first_doc_id, len(document.doc_int_ids)]})
+        manifest["doc_store"]  = doc_store.state() if doc_store is not None else None
+        manifest["vocabulary"] = len(vocabulary)
+        vocabulary.save(os.path.join(out_dir, VOCABULARY))
+        save_manifest(manifest)
         
-        block_files.append(block_name)
+        block_files.append(block_path)
     print("")
 
+    if doc_store is not None:
+        doc_store.close()
+
     # merge the blocks together
     print("Merging Blocks...")
-    idx_lines = merge_blocks(block_files, "index")
+    index_file = os.path.join(out_dir, "index")
+    if mergers > 1:
+        idx_lines = merge_blocks_parallel(block_files, index_file, vocabulary, mergers, fields)
+    else:
+        idx_lines = merge_blocks(block_files, index_file, vocabulary, fields=fields)
     print("Done Merging.")
 
+    # create the term dictionary for looking up (and expanding) terms
+    print("Creating Term Dictionary...")
+    build_term_dictionary(index_file, index_file + ".dict")
+
+    if forward:
+        print("Creating Forward Index...")
+        build_forward_index(index_file, index_file + ".fwd", document_set_lengths)
+
     # delete blocks because we don't need them anymore
     if not preserve:
         for block in block_files:
             os.remove(block)
+        os.remove(os.path.join(out_dir, VOCABULARY))
 
     print("Saving Meta Information...")
     idx = IndexMeta(document_lengths, document_set_lengths, document.doc_int_ids, idx_lines,
-                    special, case, stop, lemma, stemming)
-    with open("index.meta", mode="wb") as idx_file:
+                    special, case, stop, lemma, stemming,
+                    {field: array("I", field_lengths[field]) for field in fields})
+    with open(index_file + ".meta", mode="wb") as idx_file:
         # persist the Index object with the pickle module
         pickle.dump(idx, idx_file)
+
+    # the run is complete, so the checkpoints aren't needed anymore
+    for entry in manifest["completed"]:
+        os.remove(os.path.join(out_dir, entry["meta"]))
+    os.remove(os.path.join(out_dir, MANIFEST))
+
+    # switch the searches over to the new snapshot and drop the ones nobody should use anymore
+    publish(out_dir)
+    print("Published Snapshot '%s'." % out_dir)
+    for snapshot in collect_garbage(keep=keep):
+        dbg("Deleted old Snapshot '%s'" % snapshot)
     print("Done.")
 
     # debug prints if specified
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+import argparse
+import os.path
+import pickle
+from util.scoring import SCORING_FUNCTIONS, CollectionStatistics, calc_posting_scores
+from util.searcher import Searcher
+from util.snapshot import resolve_index
+from util.termdict import build_term_dictionary
+from util.topicParser import parse_topic
+from util.util import PostingsListItem
+
+# static index pruning: postings whose score contribution is too low are removed
+# * global: remove all postings with a score below an absolute threshold
+# * per term: remove postings with a score below epsilon * (best score of the term)
+#   (as in "Static Index Pruning for Information Retrieval Systems", Carmel et al.)
+
+# the rankings are compared with Searchers reading only the topics' postings (within this many MB)
+CACHE_SIZE = 64
+
+
+def dbg(*args, **kwargs):
+    if DEBUG:
+        print(*args, **kwargs)
+
+
+def all_documents(pli: PostingsListItem) -> set:
+    """The documents containing the term in the text or in any of the fields"""
+    return set(pli.occurrences).union(*pli.field_occurrences().values())
+
+
+def open_searcher(index_file: str) -> Searcher:
+    """Open a Searcher on the index, reading the postings on demand if there is a term dictionary"""
+    if os.path.isfile(index_file + ".dict"):
+        return Searcher(index_file, cache_size=CACHE_SIZE * 1024 * 1024)
+    return Searcher(index_file)
+
+
+# add argument parsing
+parser = argparse.ArgumentParser(description="Creates a statically pruned copy of an inverted index",
+                                 epilog="Maximilian Moser and Wolfgang Weintritt, 2018")
+
+parser.add_argument("--scoring-function", "-s", help="Scoring Function", choices=SCORING_FUNCTIONS, default="bm25")
+parser.add_argument("--k1", "-k1", help="BM25 Parameter k_1", type=float, default=1.2)
+parser.add_argument("--k3", "-k3", help="BM25 Parameter k_3", type=float, default=1.2)
+parser.add_argument("--b", "-b", help="BM25 Parameter b", type=float, default=0.75)
+parser.add_argument("--threshold", "-t", help="Global threshold: remove postings scoring below this value", type=float)
+parser.add_argument("--epsilon", "-e", help="Per-term threshold: remove postings scoring below epsilon * best score of the term", type=float)
+parser.add_argument("--index", "-i", help="Index to prune, default: the published snapshot")
+parser.add_argument("--output", "-o", help="Name of the pruned index", default="index-pruned")
+parser.add_argument("--topics", "-q", help="Topic file for comparing the rankings of both indices")
+parser.add_argument("--depth", "-k", help="Number of top documents per topic to compare", type=int, default=1000)
+parser.add_argument("--debug", "-d", help="Activate Debugging", action="store_true")
+args = parser.parse_args()
+
+scoring    = args.scoring_function
+k1         = args.k1
+k3         = args.k3
+b          = args.b
+threshold  = args.threshold
+epsilon    = args.epsilon
+index_file = resolve_index(args.index)
+output     = args.output
+topic_file = args.topics
+depth      = args.depth
+DEBUG      = args.debug
+
+if (threshold is None) == (epsilon is None):
+    print("Exactly one of --threshold and --epsilon has to be specified! Aborting.")
+    exit(1)
+
+if not os.path.isfile(index_file) or not os.path.isfile(index_file + ".meta"):
+    print("Either '%s' or '%s.meta' file could not be found! Aborting." % (index_file, index_file))
+    exit(1)
+
+with open(index_file + ".meta", "rb") as idx_meta_file:
+    idx_meta = pickle.load(idx_meta_file)
+
+stats = CollectionStatistics.from_meta(idx_meta)
+
+# the dfs before pruning are kept for the terms losing postings, such that the kept postings keep
+# their scores (idf included) - for a pruned index, the ones of the original index are kept
+document_frequencies          = dict(stats.document_frequencies)
+combined_document_frequencies = dict(stats.combined_document_frequencies)
+
+# prune the index line by line, so that it never has to be in memory completely
+postings_before = 0
+postings_after  = 0
+item_count      = 0
+with open(index_file, "r") as idx_file, open(output, "w") as out_file:
+    for line_idx, line in enumerate(idx_file, 1):
+        if not line.strip():
+            continue
+
+        pli    = PostingsListItem.from_json(line.strip())
+        scores = calc_posting_scores(pli, stats, scoring, k1, k3, b)
+        item_count += 1
+        if scores:
+            limit = threshold if threshold is not None else epsilon * max(scores.values())
+            kept  = set(doc for doc, score in scores.items() if score >= limit)
+
+            if not kept:
+                # keep at least the best posting, such that no term vanishes from the vocabulary
+                kept = {max(scores, key=scores.get)}
+
+            # the documents are pruned from the text's and the fields' postings alike
+            documents = all_documents(pli)
+            if len(kept) < len(documents):
+                document_frequencies[pli.token]          = stats.document_frequency(pli)
+                combined_document_frequencies[pli.token] = stats.combined_document_frequency(pli, documents)
+            postings_before += len(scores)
+            postings_after  += len(kept)
+            pli.occurrences  = {doc: cnt for doc, cnt in pli.occurrences.items() if doc in kept}
+            if pli.field_section is not None:
+                pli.set_field_occurrences({field: {doc: cnt for doc, cnt in occurrences.items() if doc in kept}
+                                           for field, occurrences in pli.field_occurrences().items()})
+        out_file.write("%s\n" % pli.to_json())
+
+        if line_idx % 1000 == 0:
+            print("Pruned %d/%d terms" % (line_idx, idx_meta.item_count), end="\r")
+print("")
+
+# the meta information stays the same (the documents didn't change), except for the item count and the dfs
+idx_meta.item_count                    = item_count
+idx_meta.document_frequencies          = document_frequencies
+idx_meta.combined_document_frequencies = combined_document_frequencies
+with open(output + ".meta", "wb") as out_meta_file:
+    pickle.dump(idx_meta, out_meta_file)
+build_term_dictionary(output, output + ".dict")
+
+size_before = os.path.getsize(index_file)
+size_after  = os.path.getsize(output)
+print("Postings  : %d -> %d (%.2f%% removed)" % (postings_before, postings_after,
+                                               100 * (1 - postings_after / max(postings_before, 1))))
+print("Index size: %d -> %d bytes (%.2f%% smaller)" % (size_before, size_after,
+                                                       100 * (1 - size_after / max(size_before, 1))))
+
+if topic_file is not None:
+    # compare the top documents per topic of both indices, ranked exactly like the search does
+    topics          = parse_topic(topic_file)
+    full_searcher   = open_searcher(index_file)
+    pruned_searcher = open_searcher(output)
+    full_results    = full_searcher.search_many(topics, scoring, k1, k3, b, top_k=depth)
+    pruned_results  = pruned_searcher.search_many(topics, scoring, k1, k3, b, top_k=depth)
+    full_searcher.close()
+    pruned_searcher.close()
+
+    overlaps = []
+    for topic_id in topics:
+        full   = set(result.doc_id for result in full_results[topic_id])
+        pruned = set(result.doc_id for result in pruned_results[topic_id])
+        if not full:
+            continue
+
+        overlap = len(full & pruned) / len(full)
+        overlaps.append(overlap)
+        dbg("Topic %s: overlap@%d = %.4f" % (topic_id, depth, overlap))
+
+    if overlaps:
+        print("Ranking overlap@%d: %.4f (mean over %d topics)" % (depth, sum(overlaps) / len(overlaps), len(overlaps)))
+    else:
+        print("None of the topics matched any document")
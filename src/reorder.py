@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import os.path
+import pickle
+import shutil
+import time
+import zlib
+from array import array
+from math import log10
+from typing import List
+from util.docstore import DocStore, DocStoreWriter
+from util.forward import build_forward_index
+from util.scoring import SCORING_FUNCTIONS
+from util.searcher import Searcher
+from util.snapshot import collect_garbage, current_snapshot, new_snapshot, publish
+from util.termdict import build_term_dictionary
+from util.topicParser import parse_topic
+from util.util import PostingsListItem, decode_postings, encode_postings
+
+# reassign the internal document IDs, such that the gaps in the postings become smaller
+# * docno:   order the documents by their DOCNO (usually the order of the source)
+# * cluster: group the documents by their most characteristic (highest tf-idf) term and
+#            order each group by min-hash, such that similar documents get neighbouring IDs
+
+
+def dbg(*args, **kwargs):
+    if DEBUG:
+        print(*args, **kwargs)
+
+
+def cluster_order(index_file: str, doc_int_ids: List[str]) -> List[int]:
+    """Group the documents by their most characteristic term, ordered by min-hash within a group"""
+    # terms occurring almost everywhere say nothing about the similarity of documents,
+    # so they are skipped (they would otherwise dominate the min-hash)
+    no_docs     = len(doc_int_ids)
+    max_df      = max(no_docs // 10, 1)
+    best_weight = array("d", [0.0]) * no_docs
+    best_term   = array("L", [0]) * no_docs
+    min_hash    = array("L", [0xFFFFFFFF]) * no_docs
+
+    with open(index_file, "r") as idx_file:
+        for term_id, line in enumerate(idx_file):
+            if not line.strip():
+                continue
+
+            pli = PostingsListItem.from_json(line.strip())
+            if pli.count() == 0 or pli.count() > max_df:
+                # (terms only occurring in a field have no text postings)
+                continue
+
+            idf       = log10(no_docs / pli.count())
+            term_hash = zlib.crc32(pli.token.encode("utf8"))
+            for doc, cnt in pli.occurrences.items():
+                # the characteristic term is the one with the highest tf-idf weight
+                if cnt * idf > best_weight[doc]:
+                    best_weight[doc] = cnt * idf
+                    best_term[doc]   = term_id
+                if term_hash < min_hash[doc]:
+                    min_hash[doc] = term_hash
+
+    return sorted(range(no_docs), key=lambda d: (best_term[d], min_hash[d], doc_int_ids[d]))
+
+
+def compressed_size(index_file: str) -> int:
+    """Size of the index' postings in the gap-compressed format"""
+    size = 0
+    with open(index_file, "r") as idx_file:
+        for line in idx_file:
+            if line.strip():
+                size += len(encode_postings(PostingsListItem.from_json(line.strip())))
+    return size
+
+
+def measure_queries(index_file: str, topics, repetitions: int = 10) -> (float, float):
+    """Time per topic for searching and for decoding the topics' gap-compressed postings (best of the repetitions)"""
+    searcher = Searcher(index_file)
+    search_time = None
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        searcher.search_many(topics, scoring, k1, k3, b)
+        elapsed = (time.perf_counter() - start) / len(topics)
+        search_time = elapsed if search_time is None else min(search_time, elapsed)
+
+    # the postings are only kept as JSON in the index, so the traversal
+    # of the compressed format is measured on the encoded postings
+    encoded = {}
+    for query in topics.values():
+        for token in searcher.tokenize(query):
+            if token in searcher.postings_list and token not in encoded:
+                encoded[token] = encode_postings(searcher.postings_list[token])
+
+    tokenized   = [set(searcher.tokenize(query)) for query in topics.values()]
+    decode_time = None
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        for tokens in tokenized:
+            for token in tokens:
+                if token in encoded:
+                    decode_postings(encoded[token])
+        elapsed = (time.perf_counter() - start) / len(topics)
+        decode_time = elapsed if decode_time is None else min(decode_time, elapsed)
+
+    searcher.close()
+    return (search_time, decode_time)
+
+
+# add argument parsing
+parser = argparse.ArgumentParser(description="Reassigns the internal document IDs of an index",
+                                 epilog="Maximilian Moser and Wolfgang Weintritt, 2018")
+
+parser.add_argument("--order", "-o", help="New order of the documents", choices=["docno", "cluster"], default="cluster")
+parser.add_argument("--index", "-i", help="Index to reorder in place, default: the published snapshot (reordered into a new one)")
+parser.add_argument("--topics", "-q", help="Topic file for comparing the query latency")
+parser.add_argument("--scoring-function", "-s", help="Scoring Function for the latency comparison", choices=SCORING_FUNCTIONS, default="bm25")
+parser.add_argument("--k1", "-k1", help="BM25 Parameter k_1", type=float, default=1.2)
+parser.add_argument("--k3", "-k3", help="BM25 Parameter k_3", type=float, default=1.2)
+parser.add_argument("--b", "-b", help="BM25 Parameter b", type=float, default=0.75)
+parser.add_argument("--keep-snapshots", "-k", help="Number of published index snapshots to keep", type=int, default=2)
+parser.add_argument("--debug", "-d", help="Activate Debugging", action="store_true")
+args = parser.parse_args()
+
+order      = args.order
+index_file = args.index
+topic_file = args.topics
+scoring    = args.scoring_function
+k1         = args.k1
+k3         = args.k3
+b          = args.b
+keep       = max(args.keep_snapshots, 1)
+DEBUG      = args.debug
+
+# published snapshots are never changed (searches may be using them), the reordered
+# index becomes a new snapshot instead - an explicitly given index is replaced in place
+snapshot = current_snapshot() if index_file is None else None
+if snapshot is not None:
+    index_file = os.path.join(snapshot, "index")
+else:
+    index_file = index_file or "index"
+
+if not os.path.isfile(index_file) or not os.path.isfile(index_file + ".meta"):
+    print("Either '%s' or '%s.meta' file could not be found! Aborting." % (index_file, index_file))
+    exit(1)
+
+with open(index_file + ".meta", "rb") as idx_meta_file:
+    idx_meta = pickle.load(idx_meta_file)
+
+topics = parse_topic(topic_file) if topic_file is not None else None
+size_before = compressed_size(index_file)
+if topics:
+    (search_before, decode_before) = measure_queries(index_file, topics)
+
+# old_ids[new_id] = old_id and new_ids[old_id] = new_id
+print("Ordering documents by %s..." % order)
+doc_int_ids = idx_meta.doc_int_ids
+if order == "docno":
+    old_ids = sorted(range(len(doc_int_ids)), key=lambda d: doc_int_ids[d])
+else:
+    old_ids = cluster_order(index_file, doc_int_ids)
+
+new_ids = array("L", [0]) * len(old_ids)
+for new_id, old_id in enumerate(old_ids):
+    new_ids[old_id] = new_id
+
+# the new index is only created now, such that an abort above leaves nothing behind
+new_index = os.path.join(new_snapshot(), "index") if snapshot is not None else index_file + ".tmp"
+suffixes  = ["", ".meta", ".dict"]
+try:
+    # rewrite the index with the new IDs (and the postings sorted by them)
+    print("Rewriting index...")
+    with open(index_file, "r") as idx_file, open(new_index, "w") as out_file:
+        for line in idx_file:
+            if not line.strip():
+                continue
+            pli = PostingsListItem.from_json(line.strip())
+            pli.occurrences = {new_ids[doc]: cnt for doc, cnt in sorted(pli.occurrences.items(), key=lambda x: new_ids[x[0]])}
+            if pli.field_section is not None:
+                pli.set_field_occurrences({field: {new_ids[doc]: cnt for doc, cnt in sorted(occurrences.items(), key=lambda x: new_ids[x[0]])}
+                                           for field, occurrences in pli.field_occurrences().items()})
+            out_file.write("%s\n" % pli.to_json())
+
+    idx_meta.document_lengths     = [idx_meta.document_lengths[d] for d in old_ids]
+    idx_meta.document_set_lengths = [idx_meta.document_set_lengths[d] for d in old_ids]
+    idx_meta.doc_int_ids          = [doc_int_ids[d] for d in old_ids]
+    idx_meta.field_lengths        = {field: array("I", (lengths[d] for d in old_ids))
+                                     for field, lengths in getattr(idx_meta, "field_lengths", {}).items()}
+    if os.path.isfile(index_file + ".docs"):
+        print("Rewriting document store...")
+        old_store = DocStore(index_file + ".docs")
+        new_store = DocStoreWriter(new_index + ".docs")
+        for new_id, old_id in enumerate(old_ids):
+            doc = old_store.get(old_id)
+            doc.int_id = new_id
+            new_store.add(doc)
+        new_store.close()
+        old_store.close()
+        suffixes.append(".docs")
+
+    # the dictionary (line offsets) and forward index (doc IDs) depend on the new index
+    build_term_dictionary(new_index, new_index + ".dict")
+    if os.path.isfile(index_file + ".fwd"):
+        print("Rebuilding forward index...")
+        build_forward_index(new_index, new_index + ".fwd", idx_meta.document_set_lengths)
+        suffixes.append(".fwd")
+
+    # the meta information is written last, marking the new index as complete
+    with open(new_index + ".meta", "wb") as out_meta_file:
+        pickle.dump(idx_meta, out_meta_file)
+except BaseException:
+    # don't leave a half-written index behind (neither a snapshot, nor the temporary files)
+    if snapshot is not None:
+        shutil.rmtree(os.path.dirname(new_index), ignore_errors=True)
+    else:
+        for suffix in ["", ".meta", ".dict", ".docs", ".fwd"]:
+            if os.path.isfile(new_index + suffix):
+                os.remove(new_index + suffix)
+    raise
+
+# all files are replaced at the end, such that they never get mixed up
+if snapshot is not None:
+    publish(os.path.dirname(new_index))
+    print("Published Snapshot '%s'." % os.path.dirname(new_index))
+    for deleted in collect_garbage(keep=keep):
+        dbg("Deleted old Snapshot '%s'" % deleted)
+    index_file = new_index
+else:
+    for suffix in suffixes:
+        os.replace(new_index + suffix, index_file + suffix)
+print("Done.")
+
+size_after = compressed_size(index_file)
+print("Gap-compressed postings: %d -> %d bytes (%.2f%% smaller)"
+      % (size_before, size_after, 100 * (1 - size_after / max(size_before, 1))))
+if topics:
+    (search_after, decode_after) = measure_queries(index_file, topics)
+    print("Search per topic       : %.3f -> %.3f ms" % (1000 * search_before, 1000 * search_after))
+    print("Decoding per topic     : %.3f -> %.3f ms" % (1000 * decode_before, 1000 * decode_after))
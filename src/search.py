@@ -1,21 +1,12 @@
 #!/usr/bin/env python3
 
 import argparse
-import os.path
-import pickle
 import datetime
-from collections import Counter
-from math import log10
 from operator import neg
-from pprint import pprint
-from sortedcontainers import SortedDict
-from typing import Dict
-from util.tokenize import Tokenizer
+from util.postings_cache import CACHE_POLICIES
+from util.scoring import DEFAULT_FIELD_WEIGHTS, SCORING_FUNCTIONS
+from util.searcher import Searcher, SnapshotSearcher, markup_re
 from util.topicParser import parse_topic
-from util.util import PostingsListItem
-
-
-TOPIC_STOPWORDS = ['document', 'relevant', 'mention']
 
 
 def dbg(*args, **kwargs):
@@ -23,45 +14,24 @@ def dbg(*args, **kwargs):
         print(*args, **kwargs)
 
 
-def calc_word_doc_scores(word: str) -> Dict[int, float]:
-    """calculate document scores for a word, returns a dictionary with (doc_id => score)"""
-    if word not in postings_list:
-        return {}
-
-    document_scores_for_word = {}
-    posting_item = postings_list[word]
-    df_t = posting_item.count()
-
-    idf = log10(number_of_docs / df_t)
-    for doc_id, doc_freq in posting_item.occurrences.items():
-        tf_d = log10(1 + doc_freq)
-        current_score = document_scores_for_word.get(doc_id, 0)
-        if scoring == 'tfidf':
-            # w_t,d = log (1 + tf_t,d) * log (N / df_t)
-            document_scores_for_word[doc_id] = current_score + (tf_d * idf)
-        elif scoring == 'bm25':
-            # formula from "Grundlagen des Information Retrieval 2015W, slides 29.10, slide 32)
-            # RSV_d = idf_t * ((k_1 + 1) * tf_t,d / k_1 * ((1-b)+b * (L_d / L_avg)) * tf_t,d)
-            # k1: tuning parameter controlling the document TF scaling
-            # b: tuning parameter controlling the scaling by document length
-            upper_part = (k1 + 1) * tf_d
-            lower_part = k1 * ((1 - b) + b * (document_lengths[doc_id] / avg_document_length)) + tf_d
-            document_scores_for_word[doc_id] = current_score + (idf * (upper_part / lower_part))
-
-        elif scoring == 'bm25alt' or scoring == 'bm25va':
-            if scoring == 'bm25alt':
-                # formula from paper "Verboseness Fission for BM25 Document Length Normalization"
-                b_va = (1 - b) + (b * (document_lengths[doc_id] / avg_document_length))
-            else: # bm25va
-                # formula from paper "Verboseness Fission for BM25 Document Length Normalization"
-                b_va = (mean_avg_tf ** (-2)) * (document_lengths[doc_id] / document_set_lengths[doc_id]) + (1 - mean_avg_tf ** (-1)) * (document_lengths[doc_id] / avg_document_length)
-            tf_d_normalized = tf_d / b_va
-            first_fraction = ((k3 + 1) * topic_tf_q[topic_id][word]) / (k3 + topic_tf_q[topic_id][word])
-            second_fraction = ((k1 + 1) * tf_d_normalized) / (k1 + tf_d_normalized)
-            third_fraction = log10((number_of_docs + 0.5) / (df_t + 0.5))
-            document_scores_for_word[doc_id] = current_score + (first_fraction * second_fraction * third_fraction)
-
-    return document_scores_for_word
+def parse_field_weights(text: str) -> dict:
+    """Parse field weights like 'text=1,headline=2' (the fields that aren't given keep their default weight)"""
+    weights = dict(DEFAULT_FIELD_WEIGHTS)
+    for part in text.split(","):
+        if not part.strip():
+            continue
+        (field, _, weight) = part.partition("=")
+        try:
+            weights[field.strip()] = float(weight)
+        except ValueError:
+            raise argparse.ArgumentTypeError("invalid field weight: '%s'" % part)
+    return weights
+
+
+def report_feedback(topic_id, expansion, expansion_time, rescoring_time):
+    """Print a topic's pseudo-relevance feedback (debugging only)"""
+    dbg("Topic %s expanded with %s (%.2f ms expansion, %.2f ms rescoring)"
+        % (topic_id, expansion, expansion_time * 1000, rescoring_time * 1000))
 
 
 def query_user_arguments(old_run_name, old_topic_file, old_scoring, old_k1, old_k3, old_b):
@@ -90,13 +60,14 @@ def query_user_arguments(old_run_name, old_topic_file, old_scoring, old_k1, old_
     chosen = None
     while chosen is None:
         try:
-            choices = {1: "tfidf", 2: "bm25", 3: "bm25alt", 4: "bm25va"}
-            inv_choices = {"tfidf": 1, "bm25": 2, "bm25alt": 3, "bm25va": 4}
+            choices = {1: "tfidf", 2: "bm25", 3: "bm25alt", 4: "bm25va", 5: "bm25f"}
+            inv_choices = {"tfidf": 1, "bm25": 2, "bm25alt": 3, "bm25va": 4, "bm25f": 5}
             print("Scoring Functions")
             print(" 1) TF-IDF")
             print(" 2) BM25")
             print(" 3) BM25, Alternative")
             print(" 4) BM25VA")
+            print(" 5) BM25F")
             choice = input("Scoring Function ['%d']: " % inv_choices[old_scoring])
             if not choice:
                 choice = inv_choices[old_scoring]
@@ -169,12 +140,23 @@ def query_user_arguments(old_run_name, old_topic_file, old_scoring, old_k1, old_
 parser = argparse.ArgumentParser(description="Takes query and searches index for fitting documents",
                                  epilog="Maximilian Moser and Wolfgang Weintritt, 2018")
 
-parser.add_argument("--scoring-function", "-s", help="Scoring Function", choices=['tfidf', 'bm25', 'bm25va', 'bm25alt'], default="tfidf")
+parser.add_argument("--scoring-function", "-s", help="Scoring Function", choices=SCORING_FUNCTIONS, default="tfidf")
 parser.add_argument("--k1", "-k1", help="BM25 Parameter k_1", type=float, default=1.2)
 parser.add_argument("--k3", "-k3", help="BM25 Parameter k_3", type=float, default=1.2)
 parser.add_argument("--b", "-b", help="BM25 Parameter b", type=float, default=0.75)
+parser.add_argument("--field-weights", "-F", help="BM25F weights of the fields, e.g. 'text=1,headline=2'", type=parse_field_weights,
+                    default=DEFAULT_FIELD_WEIGHTS)
 parser.add_argument("--debug", "-d", help="Activate Debugging", action="store_true")
+parser.add_argument("--index", "-i", help="Index file to search (meta information and term dictionary are expected next to it), default: the published snapshot")
 parser.add_argument("--run_name", "-r", help="Name of your run", default="grp13-exp1")
+parser.add_argument("--max-expansions", "-e", help="Maximum number of terms a wildcard (e.g. 'econom*') expands to", type=int, default=50)
+parser.add_argument("--prf-docs", "-P", help="Expand the topics with terms from this many top documents (pseudo-relevance feedback)", type=int, default=0)
+parser.add_argument("--prf-terms", "-T", help="Number of terms to add per topic with pseudo-relevance feedback", type=int, default=10)
+parser.add_argument("--snippets", "-n", help="Write snippets for this many top results per topic", type=int, default=0)
+parser.add_argument("--batch", "-B", help="Score this many topics together, walking each term's postings once for all of them (0: one topic at a time)", type=int, default=0)
+parser.add_argument("--cache-size", "-C", help="Read the postings on demand, caching at most this many MB of decoded postings (requires the term dictionary)", type=float)
+parser.add_argument("--cache-policy", help="Eviction policy of the postings cache", choices=CACHE_POLICIES, default="lru")
+parser.add_argument("--warm", "-W", help="Query log (one query per line) to warm the postings cache with")
 parser.add_argument("topic_file", help="Topic file, can contain multiple topics")
 args = parser.parse_args()
 
@@ -182,40 +164,53 @@ scoring    = args.scoring_function
 k1         = args.k1
 k3         = args.k3
 b          = args.b
+field_weights = args.field_weights
 run_name   = args.run_name
 topic_file = args.topic_file
 DEBUG      = args.debug
+max_expansions = args.max_expansions
+index_file     = args.index
+prf_docs       = args.prf_docs
+prf_terms      = args.prf_terms
+snippets       = args.snippets
+batch_size     = args.batch
+cache_size     = int(args.cache_size * 1024 * 1024) if args.cache_size is not None else None
+cache_policy   = args.cache_policy
+warm_file      = args.warm
 
 dbg("Activated Options")
 dbg("Scoring       : %s" % scoring)
 dbg("Parameter k_1 : %s" % k1)
 dbg("Parameter k_3 : %s" % k3)
 dbg("Parameter b   : %s" % b)
+dbg("Field weights : %s" % field_weights)
 dbg("Topic File    : %s" % topic_file)
 dbg()
 
-if not os.path.isfile("index") or not os.path.isfile("index.meta"):
-    print("Either 'index' or 'index.meta' file could not be found! Aborting.")
+warm_queries = None
+if warm_file is not None:
+    with open(warm_file) as log_file:
+        warm_queries = [line.strip() for line in log_file if line.strip()]
+
+try:
+    if index_file is None:
+        # follow the snapshots published by the indexer (falls back to a plain 'index')
+        snapshots = SnapshotSearcher(".", max_expansions, True, cache_size, cache_policy, warm_queries,
+                                     field_weights)
+        searcher  = snapshots.current()
+    else:
+        snapshots = None
+        searcher  = Searcher(index_file, max_expansions, True, cache_size, cache_policy, field_weights)
+        if warm_queries:
+            searcher.warm(warm_queries)
+except FileNotFoundError as e:
+    print("%s! Aborting." % e)
     print("Please execute the indexer first")
     exit(1)
 
-# read the index metadata
-with open("index.meta", "rb") as idx_meta_file:
-    idx_meta = pickle.load(idx_meta_file)
-
-dbg("Read index...")
-
-
-document_lengths     = idx_meta.document_lengths
-document_set_lengths = idx_meta.document_set_lengths
-special              = idx_meta.special_strings
-case                 = idx_meta.case_folding
-stop                 = idx_meta.stop_words
-lemma                = idx_meta.lemmatization
-stem                 = idx_meta.stemming
-item_count           = idx_meta.item_count
-doc_int_ids          = idx_meta.doc_int_ids
+index_file = searcher.index_file
 
+idx_meta = searcher.meta
 dbg("Deserialized Index")
 dbg("Special   : %s" % idx_meta.special_strings)
 dbg("Case      : %s" % idx_meta.case_folding)
@@ -223,81 +218,109 @@ dbg("Stop      : %s" % idx_meta.stop_words)
 dbg("Lemma     : %s" % idx_meta.lemmatization)
 dbg("Stemming  : %s" % idx_meta.stemming)
 dbg("Idx items : %s" % idx_meta.item_count)
+if searcher.term_dict is not None:
+    dbg("Opened term dictionary (%d terms)" % len(searcher.term_dict))
+if searcher.forward_index is not None:
+    dbg("Opened forward index (%d documents)" % len(searcher.forward_index))
+if searcher.doc_store is not None:
+    dbg("Opened document store (%d documents)" % len(searcher.doc_store))
+
+if prf_docs > 0 and (searcher.forward_index is None or searcher.term_dict is None):
+    print("Pseudo-relevance feedback requires '%s.dict' and '%s.fwd'! Aborting." % (index_file, index_file))
+    print("Please execute the indexer with --forward-index first")
+    exit(1)
 
+if snippets > 0 and searcher.doc_store is None:
+    print("Snippets require '%s.docs'! Aborting." % index_file)
+    print("Please execute the indexer with --doc-store first")
+    exit(1)
 
-# read the postings_list from the index file
-postings_list = {}
-with open("index", "r") as idx_file:
-    line = idx_file.readline()
-    line_idx = 1
-    while line:
-        percent_done = (line_idx / item_count) * 100
-        done = int((line_idx / item_count) * 50)
-        balkan = "[%s%s]" % ("#" * done, " " * (50 - done))
-        print("%s Idx Lines processed: %d/%d (%.2f%%)" % (balkan, line_idx, item_count, percent_done), end="\r")
-        line_idx += 1
-        if line.strip():
-            pli = PostingsListItem.from_json(line.strip())
-            postings_list[pli.token] = pli
-        line = idx_file.readline()
-
-print("")
-dbg("Created PL...")
-
-number_of_docs = len(document_lengths)
-avg_document_length = sum(document_lengths) / number_of_docs
-mean_avg_tf = (1 / number_of_docs) * sum([x/y for (x,y) in zip(document_lengths, document_set_lengths)])
-dbg("Got doc/set lengths")
-
+# only imported now, such that printing the help or a missing index don't have to wait for it
+from sortedcontainers import SortedDict
 
 another_round = True
 while another_round:
-    topics = parse_topic(topic_file)
-    # tokenize the topics content with the same options that the index was created with, omit repeated tokens
-    tokenizer = Tokenizer(case, special, stop, stem, lemma, TOPIC_STOPWORDS)
-    tokenized_topics = {k: tokenizer.tokenize(v) for k, v in topics.items()}
-    topic_tf_q       = {k: Counter(v) for k, v in tokenized_topics.items()}
-    tokenized_topics = {k: set(v)     for k, v in tokenized_topics.items()}
-    #dbg(tokenized_topics)
-    #dbg(topic_tf_q)
-    dbg("Tokenized_topics...")
-
-    word_doc_score = {}  # dict: word => {doc: score}, keep it for the whole run, so we do not calculate the scores multiple times.
-    top_1000_scores = SortedDict(neg, {})  # sorted dict: score => (topic, dict)
-    for topic_id, topic_tokens in tokenized_topics.items():
-        document_scores = {}  # dict: document => score
-        for word in topic_tokens:
-            if scoring == "bm25va" or scoring == "bm25alt" or word not in word_doc_score:
-                word_doc_score[word] = calc_word_doc_scores(word)
-
-            # take the score for the document for this word, add it to the score for the document for this topic.
-            for doc_id, score in word_doc_score[word].items():
-                current_doc_score = document_scores.get(doc_id, 0)
-                document_scores[doc_id] = current_doc_score + score
-
-        # topic length corrections: map over document_scores
-        document_scores = {k: v/len(topic_tokens) for k, v in document_scores.items()}
+    newest = snapshots.current() if snapshots is not None else searcher
+    if newest is not searcher:
+        # a newer snapshot was published (and loaded) since the last round
+        if prf_docs > 0 and (newest.forward_index is None or newest.term_dict is None) or \
+           snippets > 0 and newest.doc_store is None:
+            print("Index '%s' lacks the files for the chosen options, keeping '%s'" % (newest.index_file, searcher.index_file))
+        else:
+            searcher = newest
+            print("Switched to index '%s'" % searcher.index_file)
+
+    if scoring == "bm25f" and not searcher.stats.avg_field_lengths.keys() - {"text"}:
+        print("Index '%s' has no fields besides the text (see the indexer's --fields), BM25F only scores the text"
+              % searcher.index_file)
+
+    topics  = parse_topic(topic_file)
+    searcher.timings.reset()
+    if searcher.cache is not None:
+        searcher.cache.reset_statistics()
+    on_feedback = report_feedback if DEBUG else None
+    if batch_size > 0:
+        results = searcher.search_batch(topics, scoring, k1, k3, b, top_k=1000, prf_docs=prf_docs, prf_terms=prf_terms,
+                                        batch_size=batch_size, on_feedback=on_feedback)
+    else:
+        results = searcher.search_many(topics, scoring, k1, k3, b, top_k=1000, prf_docs=prf_docs, prf_terms=prf_terms,
+                                       on_feedback=on_feedback)
+    dbg("Searched topics...")
 
+    top_1000_scores = SortedDict(neg, {})  # sorted dict: score => (topic, dict)
+    for topic_id, topic_results in results.items():
         # now take all documents and add the ones with scores in the top 1000 overall to our sorted dict.
-        for doc_id, score in document_scores.items():
+        for result in topic_results:
             # only insert into topscore sorted dict, if the score is bigger than the worst score inside
             if len(top_1000_scores) < 1000:
-                top_1000_scores[score] = (topic_id, doc_id)
+                top_1000_scores[result.score] = (topic_id, result)
             else:
-                last_key = top_1000_scores.iloc[-1]
-                if last_key < score:
+                last_key = top_1000_scores.keys()[-1]
+                if last_key < result.score:
                     del top_1000_scores[last_key]
-                    top_1000_scores[score] = (topic_id, doc_id)
+                    top_1000_scores[result.score] = (topic_id, result)
+
+    if prf_docs > 0:
+        timings = searcher.timings
+        print("Pseudo-relevance feedback: %.2f ms expansion, %.2f ms rescoring per topic (average over %d topics)"
+              % (1000 * timings.average("prf_expansion"), 1000 * timings.average("prf_rescoring"),
+                 timings.count("prf_expansion")))
 
+    cache = searcher.cache
+    if cache is not None:
+        print("Postings cache: %.2f%% hit rate (%d hits, %d misses), %.2f of %.2f MB used by %d terms, %d evictions, %d rejected"
+              % (100 * cache.hit_rate(), cache.hits, cache.misses, cache.size / 1024 / 1024,
+                 cache.capacity / 1024 / 1024, len(cache), cache.evictions, cache.rejected))
 
     rank = 1
     now_formatted = datetime.datetime.now().strftime("%Y-%m-%d--%H-%M-%S")
     filename = "results_%s_%s_%s.txt" % (run_name, scoring, now_formatted)
     with open(filename, "w") as out_file:
-        for score, (topic_id, document_id) in top_1000_scores.items():
-            line = ("%s Q0 %s %d %f %s" % (topic_id, doc_int_ids[document_id], rank, score, run_name))
+        for score, (topic_id, result) in top_1000_scores.items():
+            line = ("%s Q0 %s %d %f %s" % (topic_id, result.docno, rank, score, run_name))
             out_file.write(line + "\n")
             dbg(line)
             rank += 1
 
-    another_round = query_user_arguments(run_name, topic_file, scoring, k1, k3, b)
\ No newline at end of file
+    if snippets > 0:
+        # attach snippets to the best results of each topic
+        topic_results = {}
+        snippets_file = "snippets_%s_%s_%s.txt" % (run_name, scoring, now_formatted)
+        with open(snippets_file, "w") as out_file:
+            for rank, (score, (topic_id, result)) in enumerate(top_1000_scores.items(), 1):
+                if topic_results.get(topic_id, 0) >= snippets:
+                    continue
+                topic_results[topic_id] = topic_results.get(topic_id, 0) + 1
+
+                doc = searcher.document(result.doc_id)
+                out_file.write("%s Q0 %s %d %f %s\n" % (topic_id, doc.id, rank, score, run_name))
+                if doc.headline:
+                    out_file.write("  %s\n" % " ".join(markup_re.sub(" ", doc.headline).split()))
+                out_file.write("  %s\n\n" % searcher.snippet(doc, topics[topic_id]))
+
+        timings = searcher.timings
+        print("Wrote snippets to '%s' (document fetch: %.3f ms average, %.3f ms max over %d documents)"
+              % (snippets_file, 1000 * timings.average("doc_fetch"), 1000 * timings.maximum("doc_fetch"),
+                 timings.count("doc_fetch")))
+
+    another_round = query_user_arguments(run_name, topic_file, scoring, k1, k3, b)
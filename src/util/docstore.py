@@ -0,0 +1,147 @@
+import mmap
+import struct
+import zlib
+from array import array
+from bisect import bisect_right
+from util.document import Document
+
+# layout of a document store file:
+#   data:    zlib-compressed blocks of consecutive documents, each document stored as
+#            (length of DOCNO, length of headline, length of text) + the UTF-8 strings
+#   table:   (block count + 1) uint64 block offsets, block count uint32 first document IDs
+#   trailer: magic, document count, block count, offset of the table
+MAGIC      = b"DST1"
+TRAILER    = struct.Struct("<4sIIQ")
+RECORD     = struct.Struct("<III")
+BLOCK_SIZE = 16 * 1024
+
+
+class DocStoreWriter:
+    """Writes documents (in the order of their internal IDs) into a compressed document store"""
+
+    def __init__(self, file_name: str, block_size: int = BLOCK_SIZE, state: dict = None):
+        self.file_name    = file_name
+        self.block_size   = block_size
+        self.buffer       = bytearray()
+        self.buffer_first = 0
+        self.doc_count    = 0
+        self.offsets      = array("Q")
+        self.first_docs   = array("I")
+
+        if state is None:
+            self.file = open(file_name, "wb")
+        else:
+            # continue a store that was interrupted, dropping everything written after the state
+            self.file       = open(file_name, "r+b")
+            self.doc_count  = state["doc_count"]
+            self.offsets    = array("Q", state["offsets"])
+            self.first_docs = array("I", state["first_docs"])
+            self.file.truncate(state["size"])
+            self.file.seek(state["size"])
+
+    def state(self) -> dict:
+        """Flush the buffered documents and return everything required for continuing the store later"""
+        self.flush()
+        self.file.flush()
+        return {"doc_count": self.doc_count, "size": self.file.tell(),
+                "offsets": list(self.offsets), "first_docs": list(self.first_docs)}
+
+    def add(self, doc: Document) -> None:
+        """Append the document - it has to be the one with the next internal ID"""
+        if doc.int_id != self.doc_count:
+            raise ValueError("Expected document #%d, got #%d" % (self.doc_count, doc.int_id))
+
+        if not self.buffer:
+            self.buffer_first = doc.int_id
+
+        fields = [(doc.id or "").encode("utf8"),
+                  (doc.headline or "").encode("utf8"),
+                  (doc.text or "").encode("utf8")]
+        self.buffer += RECORD.pack(*[len(f) for f in fields])
+        for field in fields:
+            self.buffer += field
+        self.doc_count += 1
+
+        if len(self.buffer) >= self.block_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Compress and write the buffered documents as a block"""
+        if not self.buffer:
+            return
+
+        self.offsets.append(self.file.tell())
+        self.first_docs.append(self.buffer_first)
+        self.file.write(zlib.compress(bytes(self.buffer)))
+        self.buffer = bytearray()
+
+    def close(self) -> None:
+        """Write the remaining documents and the offset table"""
+        self.flush()
+        table_offset = self.file.tell()
+        self.offsets.append(table_offset)
+        self.file.write(self.offsets.tobytes())
+        self.file.write(self.first_docs.tobytes())
+        self.file.write(TRAILER.pack(MAGIC, self.doc_count, len(self.first_docs), table_offset))
+        self.file.close()
+
+
+class DocStore:
+    """Memory-mapped, read-only document store with random access by internal document ID"""
+
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+        self.file      = open(file_name, "rb")
+        self.mmap      = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, doc_count, block_count, table_offset) = TRAILER.unpack_from(self.mmap, len(self.mmap) - TRAILER.size)
+        if magic != MAGIC:
+            raise ValueError("'%s' is not a document store file" % file_name)
+
+        self.doc_count   = doc_count
+        self.block_count = block_count
+        firsts_offset    = table_offset + 8 * (block_count + 1)
+        self.offsets     = array("Q", self.mmap[table_offset:firsts_offset])
+        self.first_docs  = array("I", self.mmap[firsts_offset:firsts_offset + 4 * block_count])
+
+        # the last decompressed block is kept, because neighbouring documents are often fetched together
+        self.cached_block = None
+        self.cached_data  = None
+
+    def close(self) -> None:
+        self.mmap.close()
+        self.file.close()
+
+    def __len__(self) -> int:
+        return self.doc_count
+
+    def _block(self, block: int) -> bytes:
+        """Get the decompressed contents of the block"""
+        if self.cached_block != block:
+            start = self.offsets[block]
+            end   = self.offsets[block + 1]
+            self.cached_data  = zlib.decompress(self.mmap[start:end])
+            self.cached_block = block
+        return self.cached_data
+
+    def get(self, doc_id: int) -> Document:
+        """Fetch the document with the internal ID"""
+        if not 0 <= doc_id < self.doc_count:
+            raise IndexError("Document ID out of range: %d" % doc_id)
+
+        block = bisect_right(self.first_docs, doc_id) - 1
+        data  = self._block(block)
+        pos   = 0
+        for _ in range(doc_id - self.first_docs[block]):
+            # skip the preceding documents in the block
+            pos += RECORD.size + sum(RECORD.unpack_from(data, pos))
+
+        lengths = RECORD.unpack_from(data, pos)
+        pos    += RECORD.size
+        fields  = []
+        for length in lengths:
+            fields.append(data[pos:pos + length].decode("utf8"))
+            pos += length
+
+        (docno, headline, text) = fields
+        return Document(docno, doc_id, text, headline or None)
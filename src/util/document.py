@@ -8,7 +8,7 @@ from typing import List
 doc_re = re.compile(r"<DOC>((.|\n)*?)</DOC>")
 docno_re = re.compile(r"<DOCNO>((.|\n)*?)</DOCNO>")
 text_re = re.compile(r"<TEXT>((.|\n)*?)</TEXT>")
-# hl_re = re.compile(r"<HEADLINE>((.|\n)*?)</HEADLINE>")
+hl_re = re.compile(r"<HEADLINE>((.|\n)*?)</HEADLINE>")
 
 # global list for mapping doc_int_id => doc_id
 doc_int_ids = []
@@ -34,21 +34,21 @@ def parse_documents(text: str) -> List[Document]:
     for doc in doc_matches:
         docno_match = docno_re.search(doc)
         text_match = text_re.search(doc)
-        # hl_match = hl_re.search(doc)
+        hl_match = hl_re.search(doc)
 
         if docno_match is None or text_match is None:
             continue
         
         docno = docno_match.group(1).strip()
         text = text_match.group(1).strip()
-        # headline = hl_match.group(1).strip() if hl_match is not None else None
+        headline = hl_match.group(1).strip() if hl_match is not None else None
 
         if not docno or not text:
             # if either the document ID or the text is empty: skip
             continue
 
         doc_int_ids.append(docno)
-        docs.append(Document(docno, len(doc_int_ids) - 1, text))
+        docs.append(Document(docno, len(doc_int_ids) - 1, text, headline))
 
     return docs
 
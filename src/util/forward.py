@@ -0,0 +1,90 @@
+import mmap
+import struct
+from array import array
+from typing import List, Tuple
+from util.util import PostingsListItem
+
+# layout of a forward index file:
+#   header:   magic, document count, postings count
+#   offsets:  (document count + 1) uint64, the start of each document's vector
+#   term ids: one uint32 per posting, sorted ascending within each document
+#   tfs:      one uint32 per posting, aligned with the term ids
+# the term ids are the ordinals of the terms in the (sorted) index and term dictionary
+MAGIC  = b"FWD1"
+HEADER = struct.Struct("<4sIQ")
+
+
+def build_forward_index(index_file: str, forward_file: str, document_set_lengths: List[int]) -> int:
+    """Invert the index into per-document term vectors, returns the number of postings"""
+    # the number of distinct terms per document is already known, so the vectors
+    # can be filled into flat arrays directly (like a counting sort)
+    offsets = array("Q", [0])
+    for set_length in document_set_lengths:
+        offsets.append(offsets[-1] + set_length)
+
+    total    = offsets[-1]
+    cursors  = array("Q", offsets[:-1])
+    term_ids = array("I", [0]) * total
+    tfs      = array("I", [0]) * total
+
+    with open(index_file, "r") as idx_file:
+        term_id = 0
+        for line in idx_file:
+            if not line.strip():
+                continue
+
+            # terms arrive in ascending order, so every vector ends up sorted
+            pli = PostingsListItem.from_json(line.strip())
+            for doc, cnt in pli.occurrences.items():
+                pos           = cursors[doc]
+                term_ids[pos] = term_id
+                tfs[pos]      = cnt
+                cursors[doc] += 1
+            term_id += 1
+
+    with open(forward_file, "wb") as fwd_file:
+        fwd_file.write(HEADER.pack(MAGIC, len(document_set_lengths), total))
+        fwd_file.write(offsets.tobytes())
+        fwd_file.write(term_ids.tobytes())
+        fwd_file.write(tfs.tobytes())
+
+    return total
+
+
+class ForwardIndex:
+    """Memory-mapped, read-only forward index (document => term vector)"""
+
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+        self.file      = open(file_name, "rb")
+        self.mmap      = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, doc_count, total) = HEADER.unpack_from(self.mmap, 0)
+        if magic != MAGIC:
+            raise ValueError("'%s' is not a forward index file" % file_name)
+
+        self.doc_count = doc_count
+        view           = memoryview(self.mmap)
+        offsets_start  = HEADER.size
+        term_ids_start = offsets_start + 8 * (doc_count + 1)
+        tfs_start      = term_ids_start + 4 * total
+        self.offsets   = view[offsets_start:term_ids_start].cast("Q")
+        self.term_ids  = view[term_ids_start:tfs_start].cast("I")
+        self.tfs       = view[tfs_start:tfs_start + 4 * total].cast("I")
+
+    def close(self) -> None:
+        # the memoryviews have to be released before the mmap can be closed
+        self.offsets.release()
+        self.term_ids.release()
+        self.tfs.release()
+        self.mmap.close()
+        self.file.close()
+
+    def __len__(self) -> int:
+        return self.doc_count
+
+    def vector(self, doc_id: int) -> Tuple[memoryview, memoryview]:
+        """Get the term vector of the document as (term ids, term frequencies)"""
+        start = self.offsets[doc_id]
+        end   = self.offsets[doc_id + 1]
+        return (self.term_ids[start:end], self.tfs[start:end])
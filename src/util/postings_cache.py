@@ -0,0 +1,180 @@
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Iterable, Optional
+from util.termdict import FrontCodedDictionary
+from util.util import PostingsListItem
+
+# decoded postings for the hot terms are kept under a byte budget, while the
+# others are read (and decoded) from the index file again when they're needed:
+# * lru:     evict the least recently used postings
+# * tinylfu: like lru, but a term only replaces the evicted ones if it was requested
+#            more often recently (estimated with a count-min sketch, "TinyLFU", Einziger et al.)
+CACHE_POLICIES = ["lru", "tinylfu"]
+
+
+def postings_size(pli: PostingsListItem) -> int:
+    """Estimate the memory used by the decoded postings (dictionary plus the int objects in it)"""
+    size = sys.getsizeof(pli.occurrences) + 2 * 28 * len(pli.occurrences) + sys.getsizeof(pli.token)
+    if pli.field_section is not None:
+        size += sys.getsizeof(pli.field_section)
+    return size
+
+
+class FrequencySketch:
+    """Count-min sketch for the recent request frequencies of terms, halved regularly to forget old requests"""
+
+    def __init__(self, width: int = 1 << 16, depth: int = 4):
+        self.width       = width
+        self.depth       = depth
+        self.counters    = array("B", [0]) * (width * depth)
+        self.additions   = 0
+        self.sample_size = 10 * width
+
+    def _positions(self, token: str):
+        return [row * self.width + hash((row, token)) % self.width for row in range(self.depth)]
+
+    def add(self, token: str) -> None:
+        for pos in self._positions(token):
+            if self.counters[pos] < 255:
+                self.counters[pos] += 1
+
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            for pos in range(len(self.counters)):
+                self.counters[pos] >>= 1
+            self.additions //= 2
+
+    def estimate(self, token: str) -> int:
+        return min(self.counters[pos] for pos in self._positions(token))
+
+
+class PostingsCache:
+    """Keeps decoded postings (token => PostingsListItem) within a budget of capacity bytes"""
+
+    def __init__(self, capacity: int, policy: str = "lru"):
+        if policy not in CACHE_POLICIES:
+            raise ValueError("Unknown cache policy: '%s'" % policy)
+
+        self.capacity  = capacity
+        self.policy    = policy
+        self.entries   = OrderedDict()  # token => (postings, size), least recently used first
+        self.size      = 0
+        self.sketch    = FrequencySketch() if policy == "tinylfu" else None
+        self.lock      = threading.Lock()
+        self.hits      = 0
+        self.misses    = 0
+        self.evictions = 0
+        self.rejected  = 0
+
+    def get(self, token: str) -> Optional[PostingsListItem]:
+        """Get the cached postings of the token (None if they aren't cached)"""
+        with self.lock:
+            if self.sketch is not None:
+                self.sketch.add(token)
+            entry = self.entries.get(token)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.entries.move_to_end(token)
+            return entry[0]
+
+    def put(self, token: str, pli: PostingsListItem) -> bool:
+        """Cache the postings (if they fit and are worth it), returns whether they were cached"""
+        size = postings_size(pli)
+        with self.lock:
+            if token in self.entries or size > self.capacity:
+                return False
+
+            # find the victims that would have to make room for the postings
+            victims = []
+            freed   = 0
+            for victim, (_, victim_size) in self.entries.items():
+                if self.size - freed + size <= self.capacity:
+                    break
+                victims.append(victim)
+                freed += victim_size
+
+            if victims and self.sketch is not None:
+                # only replace the victims if the new term is requested more often
+                estimate = self.sketch.estimate(token)
+                if any(self.sketch.estimate(victim) >= estimate for victim in victims):
+                    self.rejected += 1
+                    return False
+
+            for victim in victims:
+                del self.entries[victim]
+            self.evictions += len(victims)
+            self.size      += size - freed
+            self.entries[token] = (pli, size)
+            return True
+
+    def hit_rate(self) -> float:
+        with self.lock:
+            requests = self.hits + self.misses
+            return self.hits / requests if requests else 0
+
+    def reset_statistics(self) -> None:
+        with self.lock:
+            self.hits      = 0
+            self.misses    = 0
+            self.evictions = 0
+            self.rejected  = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+class LazyPostingsList:
+    """Read-only mapping (token => PostingsListItem) reading the postings from the index file on demand
+
+    The term dictionary's values are the offsets of the terms' lines in the index,
+    so every term costs one seek - unless its postings are still in the cache."""
+
+    def __init__(self, index_file: str, term_dict: FrontCodedDictionary, cache: PostingsCache):
+        self.index_file = index_file
+        self.term_dict  = term_dict
+        self.cache      = cache
+        self.file       = open(index_file, "rb")
+        self.file_lock  = threading.Lock()
+
+    def close(self) -> None:
+        self.file.close()
+
+    def __contains__(self, token: str) -> bool:
+        return token in self.term_dict
+
+    def __len__(self) -> int:
+        return len(self.term_dict)
+
+    def __getitem__(self, token: str) -> PostingsListItem:
+        pli = self.get(token)
+        if pli is None:
+            raise KeyError(token)
+        return pli
+
+    def get(self, token: str, default: PostingsListItem = None) -> Optional[PostingsListItem]:
+        pli = self.cache.get(token)
+        if pli is not None:
+            return pli
+
+        offset = self.term_dict.get(token)
+        if offset is None:
+            return default
+
+        with self.file_lock:
+            self.file.seek(offset)
+            line = self.file.readline()
+        pli = PostingsListItem.from_json(line.decode("utf8").strip())
+        self.cache.put(token, pli)
+        return pli
+
+    def warm(self, tokens: Iterable[str]) -> int:
+        """Load the postings of the tokens into the cache, returns the number of cached terms afterwards"""
+        for token in tokens:
+            self.get(token)
+        self.cache.reset_statistics()
+        return len(self.cache)
@@ -0,0 +1,127 @@
+from math import log10
+from typing import Dict, List
+
+SCORING_FUNCTIONS = ['tfidf', 'bm25', 'bm25va', 'bm25alt', 'bm25f']
+# default weights of the fields for bm25f (the text is the documents' text, without the other fields)
+DEFAULT_FIELD_WEIGHTS = {'text': 1.0, 'headline': 2.0}
+
+
+class CollectionStatistics:
+    """Collection-wide values that are required by the scoring functions"""
+    def __init__(self, document_lengths: List[int], document_set_lengths: List[int], field_lengths: Dict = None,
+                 document_frequencies: Dict[str, int] = None, combined_document_frequencies: Dict[str, int] = None):
+        self.document_lengths = document_lengths
+        self.document_set_lengths = document_set_lengths
+        self.number_of_docs = len(document_lengths)
+        self.avg_document_length = sum(document_lengths) / self.number_of_docs
+        self.mean_avg_tf = (1 / self.number_of_docs) * sum([x/y for (x,y) in zip(document_lengths, document_set_lengths)])
+
+        # lengths of the fields (for bm25f), the document lengths are those of the text
+        self.field_lengths = {'text': document_lengths}
+        self.field_lengths.update(field_lengths or {})
+        # (a field that's empty everywhere doesn't contribute anything, avoid dividing by zero)
+        self.avg_field_lengths = {field: (sum(lengths) / self.number_of_docs) or 1
+                                  for field, lengths in self.field_lengths.items()}
+
+        # the dfs of the terms before pruning (token => df), such that the kept postings keep their scores
+        # (in the text, and in any field for bm25f) - the others are counted from the postings
+        self.document_frequencies = document_frequencies or {}
+        self.combined_document_frequencies = combined_document_frequencies or {}
+
+    @staticmethod
+    def from_meta(meta) -> 'CollectionStatistics':
+        """Create the statistics from an index' IndexMeta (which may be older than the fields and the pruning)"""
+        return CollectionStatistics(meta.document_lengths, meta.document_set_lengths,
+                                    getattr(meta, "field_lengths", None), getattr(meta, "document_frequencies", None),
+                                    getattr(meta, "combined_document_frequencies", None))
+
+    def document_frequency(self, posting_item) -> int:
+        """df of the term in the text"""
+        return self.document_frequencies.get(posting_item.token, posting_item.count())
+
+    def combined_document_frequency(self, posting_item, documents) -> int:
+        """df of the term in any of the fields (documents: the documents of the term's postings in all fields)"""
+        return self.combined_document_frequencies.get(posting_item.token, len(documents))
+
+
+def query_term_weight(scoring: str, k3: float, tf_q: int) -> float:
+    """weight of a term that occurs tf_q times in the topic (the only part of a word's scores depending on the topic)"""
+    if scoring == 'bm25alt' or scoring == 'bm25va':
+        return ((k3 + 1) * tf_q) / (k3 + tf_q)
+    return 1
+
+
+def calc_bm25f_scores(posting_item, stats: CollectionStatistics, k1: float, b: float,
+                      field_weights: Dict[str, float]) -> Dict[int, float]:
+    """calculate the bm25f document scores for a postings list item, returns a dictionary with (doc_id => score)"""
+    # formula from paper "Simple BM25 Extension to Multiple Weighted Fields" (Robertson et al.)
+    # tf~_t,d = sum over the fields f: w_f * tf_t,d,f / ((1-b) + b * (L_d,f / L_avg,f))
+    # RSV_d = idf_t * ((k_1 + 1) * tf~_t,d) / (k_1 + tf~_t,d)
+    # the field postings are only decoded for the terms that occur in another field at all
+    fields = {'text': posting_item.occurrences}
+    if posting_item.field_section is not None:
+        fields.update(posting_item.field_occurrences())
+
+    # the df counts the documents containing the term in any of the fields
+    documents = set().union(*fields.values())
+    idf = log10(stats.number_of_docs / stats.combined_document_frequency(posting_item, documents))
+
+    document_scores_for_word = {}
+    for doc_id in documents:
+        tf_weighted = 0
+        for field, occurrences in fields.items():
+            tf_field = occurrences.get(doc_id)
+            if tf_field:
+                normalization = (1 - b) + b * (stats.field_lengths[field][doc_id] / stats.avg_field_lengths[field])
+                tf_weighted += field_weights.get(field, 1.0) * tf_field / normalization
+        document_scores_for_word[doc_id] = idf * ((k1 + 1) * tf_weighted) / (k1 + tf_weighted)
+
+    return document_scores_for_word
+
+
+def calc_posting_scores(posting_item, stats: CollectionStatistics, scoring: str,
+                        k1: float, k3: float, b: float, tf_q: int = 1,
+                        field_weights: Dict[str, float] = None) -> Dict[int, float]:
+    """calculate document scores for a postings list item, returns a dictionary with (doc_id => score)"""
+    if scoring == 'bm25f':
+        return calc_bm25f_scores(posting_item, stats, k1, b, field_weights or DEFAULT_FIELD_WEIGHTS)
+    if not posting_item.occurrences:
+        # the term only occurs in another field (e.g. the headlines), which only bm25f scores
+        return {}
+
+    document_scores_for_word = {}
+    document_lengths = stats.document_lengths
+    number_of_docs = stats.number_of_docs
+    avg_document_length = stats.avg_document_length
+    df_t = stats.document_frequency(posting_item)
+
+    idf = log10(number_of_docs / df_t)
+    first_fraction = query_term_weight(scoring, k3, tf_q)
+    for doc_id, doc_freq in posting_item.occurrences.items():
+        tf_d = log10(1 + doc_freq)
+        if scoring == 'tfidf':
+            # w_t,d = log (1 + tf_t,d) * log (N / df_t)
+            document_scores_for_word[doc_id] = tf_d * idf
+        elif scoring == 'bm25':
+            # formula from "Grundlagen des Information Retrieval 2015W, slides 29.10, slide 32)
+            # RSV_d = idf_t * ((k_1 + 1) * tf_t,d / k_1 * ((1-b)+b * (L_d / L_avg)) * tf_t,d)
+            # k1: tuning parameter controlling the document TF scaling
+            # b: tuning parameter controlling the scaling by document length
+            upper_part = (k1 + 1) * tf_d
+            lower_part = k1 * ((1 - b) + b * (document_lengths[doc_id] / avg_document_length)) + tf_d
+            document_scores_for_word[doc_id] = idf * (upper_part / lower_part)
+
+        elif scoring == 'bm25alt' or scoring == 'bm25va':
+            if scoring == 'bm25alt':
+                # formula from paper "Verboseness Fission for BM25 Document Length Normalization"
+                b_va = (1 - b) + (b * (document_lengths[doc_id] / avg_document_length))
+            else: # bm25va
+                # formula from paper "Verboseness Fission for BM25 Document Length Normalization"
+                mean_avg_tf = stats.mean_avg_tf
+                b_va = (mean_avg_tf ** (-2)) * (document_lengths[doc_id] / stats.document_set_lengths[doc_id]) + (1 - mean_avg_tf ** (-1)) * (document_lengths[doc_id] / avg_document_length)
+            tf_d_normalized = tf_d / b_va
+            second_fraction = ((k1 + 1) * tf_d_normalized) / (k1 + tf_d_normalized)
+            third_fraction = log10((number_of_docs + 0.5) / (df_t + 0.5))
+            document_scores_for_word[doc_id] = first_fraction * second_fraction * third_fraction
+
+    return document_scores_for_word
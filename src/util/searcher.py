@@ -0,0 +1,471 @@
+import heapq
+import os.path
+import pickle
+import re
+import threading
+import time
+from collections import Counter
+from math import log10
+from typing import Callable, Dict, List, Tuple
+from util.docstore import DocStore
+from util.document import Document
+from util.forward import ForwardIndex
+from util.postings_cache import LazyPostingsList, PostingsCache
+from util.scoring import SCORING_FUNCTIONS, CollectionStatistics, calc_posting_scores, query_term_weight
+from util.snapshot import current_snapshot, resolve_index
+from util.termdict import FrontCodedDictionary
+from util.tokenize import Tokenizer
+from util.util import PostingsListItem
+
+TOPIC_STOPWORDS = ['document', 'relevant', 'mention']
+SNIPPET_WORDS   = 30
+
+markup_re = re.compile(r"<[^>]*>")
+
+# called after the pseudo-relevance feedback of every topic with
+# (topic_id, expansion terms, expansion seconds, rescoring seconds)
+FeedbackCallback = Callable[[object, List[str], float, float], None]
+
+
+class SearchResult:
+    """A single ranked document"""
+    def __init__(self, doc_id: int, docno: str, score: float):
+        self.doc_id = doc_id
+        self.docno = docno
+        self.score = score
+
+    def __repr__(self) -> str:
+        return "SearchResult(%s, %s, %f)" % (self.doc_id, self.docno, self.score)
+
+
+class Timings:
+    """Thread-safe accumulator for the time spent in several operations"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.totals = {}
+        self.counts = {}
+        self.maxima = {}
+
+    def add(self, name: str, seconds: float) -> None:
+        with self.lock:
+            self.totals[name] = self.totals.get(name, 0) + seconds
+            self.counts[name] = self.counts.get(name, 0) + 1
+            self.maxima[name] = max(self.maxima.get(name, 0), seconds)
+
+    def reset(self) -> None:
+        with self.lock:
+            self.totals = {}
+            self.counts = {}
+            self.maxima = {}
+
+    def average(self, name: str) -> float:
+        """Average time of the operation in seconds (0 if it never happened)"""
+        with self.lock:
+            return self.totals.get(name, 0) / max(self.counts.get(name, 0), 1)
+
+    def maximum(self, name: str) -> float:
+        with self.lock:
+            return self.maxima.get(name, 0)
+
+    def count(self, name: str) -> int:
+        with self.lock:
+            return self.counts.get(name, 0)
+
+
+class Searcher:
+    """Searches an index that is loaded once
+
+    The searcher doesn't change after loading (except for timings, the document store's block
+    cache and the postings cache, which are locked), so search() and search_many() may be called concurrently.
+    With a cache_size (in bytes), the postings are read from the index on demand instead of being
+    loaded completely, keeping the decoded postings of the hot terms in a PostingsCache.
+    field_weights (field => weight) are used by bm25f, for an index created with --fields."""
+
+    def __init__(self, index_file: str = "index", max_expansions: int = 50, progress: bool = False,
+                 cache_size: int = None, cache_policy: str = "lru", field_weights: Dict[str, float] = None):
+        if not os.path.isfile(index_file) or not os.path.isfile(index_file + ".meta"):
+            raise FileNotFoundError("Either '%s' or '%s.meta' file could not be found" % (index_file, index_file))
+
+        self.index_file     = index_file
+        self.max_expansions = max_expansions
+        self.field_weights  = field_weights
+        self.timings        = Timings()
+        self.store_lock     = threading.Lock()
+
+        # read the index metadata
+        with open(index_file + ".meta", "rb") as idx_meta_file:
+            self.meta = pickle.load(idx_meta_file)
+
+        meta = self.meta
+        self.doc_int_ids = meta.doc_int_ids
+        self.stats       = CollectionStatistics.from_meta(meta)
+
+        # tokenize the queries with the same options that the index was created with
+        self.tokenizer        = Tokenizer(meta.case_folding, meta.special_strings, meta.stop_words,
+                                          meta.stemming, meta.lemmatization, TOPIC_STOPWORDS)
+        self.prefix_tokenizer = Tokenizer(meta.case_folding, meta.special_strings, False, False, False)
+
+        # the term dictionary, forward index and document store are optional
+        self.term_dict     = None
+        self.forward_index = None
+        self.doc_store     = None
+        if os.path.isfile(index_file + ".dict"):
+            self.term_dict = FrontCodedDictionary(index_file + ".dict")
+        if os.path.isfile(index_file + ".fwd"):
+            self.forward_index = ForwardIndex(index_file + ".fwd")
+        if os.path.isfile(index_file + ".docs"):
+            self.doc_store = DocStore(index_file + ".docs")
+
+        if cache_size is not None:
+            if self.term_dict is None:
+                raise FileNotFoundError("Reading the postings on demand requires '%s.dict'" % index_file)
+            self.cache         = PostingsCache(cache_size, cache_policy)
+            self.postings_list = LazyPostingsList(index_file, self.term_dict, self.cache)
+            return
+
+        # read the postings_list from the index file
+        self.cache         = None
+        self.postings_list = {}
+        item_count = meta.item_count
+        with open(index_file, "r") as idx_file:
+            for line_idx, line in enumerate(idx_file, 1):
+                if progress:
+                    percent_done = (line_idx / item_count) * 100
+                    done = int((line_idx / item_count) * 50)
+                    balkan = "[%s%s]" % ("#" * done, " " * (50 - done))
+                    print("%s Idx Lines processed: %d/%d (%.2f%%)" % (balkan, line_idx, item_count, percent_done), end="\r")
+                if line.strip():
+                    pli = PostingsListItem.from_json(line.strip())
+                    self.postings_list[pli.token] = pli
+        if progress:
+            print("")
+
+    def close(self) -> None:
+        if self.cache is not None:
+            self.postings_list.close()
+        for resource in (self.term_dict, self.forward_index, self.doc_store):
+            if resource is not None:
+                resource.close()
+
+    def warm(self, queries: List[str]) -> int:
+        """Fill the postings cache with the terms of the queries (e.g. from a query log), returns the cached terms"""
+        if self.cache is None:
+            return len(self.postings_list)
+        return self.postings_list.warm(token for query in queries for token in self.tokenize(query))
+
+    def expand_wildcards(self, text: str) -> Tuple[str, List[str]]:
+        """Remove the wildcard terms (e.g. 'econom*') from the text and expand them via the term dictionary"""
+        if self.term_dict is None:
+            # without term dictionary, the wildcards are treated as normal words
+            return (text, [])
+
+        words    = text.split()
+        expanded = []
+        for word in words:
+            if not word.endswith("*"):
+                continue
+
+            # the prefix is only normalized (no stemming etc.), because the prefix
+            # of a word is not necessarily a prefix of the word's stem
+            for prefix in self.prefix_tokenizer.tokenize(word.rstrip("*")):
+                expanded += self.term_dict.expand(prefix + "*", limit=self.max_expansions)
+
+        plain = [w for w in words if not w.endswith("*")]
+        return (" ".join(plain), expanded)
+
+    def tokenize(self, query: str) -> List[str]:
+        """Tokenize the query like the index (including wildcard expansion), keeping repeated tokens"""
+        (text, expanded) = self.expand_wildcards(query)
+        return self.tokenizer.tokenize(text) + expanded
+
+    def word_scores(self, word: str, scoring: str, k1: float, k3: float, b: float, tf_q: int = 1) -> Dict[int, float]:
+        """calculate document scores for a word, returns a dictionary with (doc_id => score)"""
+        if word not in self.postings_list:
+            return {}
+
+        return calc_posting_scores(self.postings_list[word], self.stats, scoring, k1, k3, b, tf_q, self.field_weights)
+
+    def score(self, topic_tf_q: Counter, scoring: str, k1: float, k3: float, b: float,
+              word_doc_score: Dict = None) -> Dict[int, float]:
+        """calculate the document scores for the topic's tokens, returns a dictionary with (doc_id => score)
+
+        word_doc_score can be used for keeping the scores of words between calls, if they don't depend
+        on the topic (i.e. for everything but bm25alt and bm25va)."""
+        if word_doc_score is None or scoring == "bm25va" or scoring == "bm25alt":
+            word_doc_score = {}
+
+        document_scores = {}  # dict: document => score
+        for word, tf_q in topic_tf_q.items():
+            if word not in word_doc_score:
+                word_doc_score[word] = self.word_scores(word, scoring, k1, k3, b, tf_q)
+
+            # take the score for the document for this word, add it to the score for the document for this topic.
+            for doc_id, score in word_doc_score[word].items():
+                document_scores[doc_id] = document_scores.get(doc_id, 0) + score
+
+        # topic length corrections: map over document_scores
+        if not topic_tf_q:
+            return {}
+        return {k: v/len(topic_tf_q) for k, v in document_scores.items()}
+
+    def score_batch(self, topic_tf_qs: Dict[int, Counter], scoring: str, k1: float, k3: float, b: float,
+                    word_doc_score: Dict = None) -> Dict[int, Dict[int, float]]:
+        """calculate the document scores for several topics at once, returns (topic_id => (doc_id => score))
+
+        The topics are grouped by word, so each word's postings are scored once for all of them;
+        the topic-dependent query term weight is only applied when adding up the topics' scores.
+        word_doc_score keeps these (topic-independent) scores between calls."""
+        if word_doc_score is None:
+            word_doc_score = {}
+
+        topics_by_word = {}  # dict: word => [(topic, tf_q)]
+        for topic_id, topic_tf_q in topic_tf_qs.items():
+            for word, tf_q in topic_tf_q.items():
+                topics_by_word.setdefault(word, []).append((topic_id, tf_q))
+
+        document_scores = {topic_id: {} for topic_id in topic_tf_qs}
+        for word, word_topics in topics_by_word.items():
+            if word not in word_doc_score:
+                word_doc_score[word] = self.word_scores(word, scoring, k1, k3, b)
+            scores = word_doc_score[word]
+            if not scores:
+                continue
+
+            # scatter the word's scores into the accumulators of all topics containing it
+            weighted = {1: scores}  # dict: tf_q => scores weighted for it
+            for topic_id, tf_q in word_topics:
+                if tf_q not in weighted:
+                    weight = query_term_weight(scoring, k3, tf_q)
+                    weighted[tf_q] = {doc_id: weight * score for doc_id, score in scores.items()}
+
+                topic_scores = document_scores[topic_id]
+                if not topic_scores:
+                    topic_scores.update(weighted[tf_q])
+                    continue
+                get = topic_scores.get
+                for doc_id, score in weighted[tf_q].items():
+                    topic_scores[doc_id] = get(doc_id, 0) + score
+
+        # topic length corrections
+        return {topic_id: {k: v/len(topic_tf_qs[topic_id]) for k, v in topic_scores.items()}
+                for topic_id, topic_scores in document_scores.items()}
+
+    def feedback_terms(self, document_scores: Dict[int, float], topic_tokens, prf_docs: int, prf_terms: int) -> List[str]:
+        """Select expansion terms from the term vectors of the top documents (pseudo-relevance feedback)"""
+        top_docs = heapq.nlargest(prf_docs, document_scores.items(), key=lambda x: x[1])
+        score_sum = sum(score for (_, score) in top_docs)
+        if not top_docs or score_sum <= 0:
+            return []
+
+        # relevance model: w(t) = sum_d P(t|d) * P(d|q), with P(d|q) ~ normalized document score
+        weights = {}
+        document_lengths = self.stats.document_lengths
+        for doc_id, score in top_docs:
+            (term_ids, tfs) = self.forward_index.vector(doc_id)
+            doc_weight = score / (score_sum * document_lengths[doc_id])
+            for term_id, tf in zip(term_ids, tfs):
+                weights[term_id] = weights.get(term_id, 0) + tf * doc_weight
+
+        # only the best candidates are resolved to terms and weighted with their idf,
+        # such that terms which are frequent everywhere don't make it into the query
+        query_ids  = set(self.term_dict.lookup(t) for t in topic_tokens)
+        candidates = heapq.nlargest(10 * prf_terms, (t for t in weights if t not in query_ids), key=weights.get)
+        expansion  = []
+        for term_id in candidates:
+            term = self.term_dict.term_at(term_id)
+            if term in self.postings_list:
+                idf = log10(self.stats.number_of_docs / self.stats.document_frequency(self.postings_list[term]))
+                expansion.append((weights[term_id] * idf, term))
+
+        expansion.sort(reverse=True)
+        return [term for (weight, term) in expansion[:prf_terms] if weight > 0]
+
+    def _rank(self, topic_tf_q: Counter, scoring: str, k1: float, k3: float, b: float, top_k: int,
+              prf_docs: int, prf_terms: int, word_doc_score: Dict = None, topic_id=None,
+              on_feedback: FeedbackCallback = None) -> List[SearchResult]:
+        """Score the tokenized topic (with optional feedback) and return the top_k results"""
+        document_scores = self.score(topic_tf_q, scoring, k1, k3, b, word_doc_score)
+
+        if prf_docs > 0:
+            # expand the topic with terms from the top documents and score it again
+            start     = time.perf_counter()
+            expansion = self.feedback_terms(document_scores, topic_tf_q, prf_docs, prf_terms)
+            expanded  = time.perf_counter()
+            for term in expansion:
+                topic_tf_q[term] += 1
+            document_scores = self.score(topic_tf_q, scoring, k1, k3, b, word_doc_score)
+            rescored  = time.perf_counter()
+            self.timings.add("prf_expansion", expanded - start)
+            self.timings.add("prf_rescoring", rescored - expanded)
+            if on_feedback is not None:
+                on_feedback(topic_id, expansion, expanded - start, rescored - expanded)
+
+        best = heapq.nlargest(top_k, document_scores.items(), key=lambda x: x[1])
+        return [SearchResult(doc_id, self.doc_int_ids[doc_id], score) for (doc_id, score) in best]
+
+    def _check_arguments(self, scoring: str, prf_docs: int) -> None:
+        if scoring not in SCORING_FUNCTIONS:
+            raise ValueError("Unknown scoring function: '%s'" % scoring)
+        if prf_docs > 0 and (self.forward_index is None or self.term_dict is None):
+            raise ValueError("Pseudo-relevance feedback requires '%s.dict' and '%s.fwd'" % (self.index_file, self.index_file))
+
+    def search(self, query: str, scoring: str = "tfidf", k1: float = 1.2, k3: float = 1.2, b: float = 0.75,
+               top_k: int = 1000, prf_docs: int = 0, prf_terms: int = 10,
+               on_feedback: FeedbackCallback = None) -> List[SearchResult]:
+        """Search the documents for the query, returns the top_k results ordered by descending score
+
+        on_feedback is called with the expansion terms and timings of the pseudo-relevance feedback (topic_id None)."""
+        self._check_arguments(scoring, prf_docs)
+        return self._rank(Counter(self.tokenize(query)), scoring, k1, k3, b, top_k, prf_docs, prf_terms,
+                          on_feedback=on_feedback)
+
+    def search_many(self, topics: Dict[int, str], scoring: str = "tfidf", k1: float = 1.2, k3: float = 1.2,
+                    b: float = 0.75, top_k: int = 1000, prf_docs: int = 0, prf_terms: int = 10,
+                    on_feedback: FeedbackCallback = None) -> Dict[int, List[SearchResult]]:
+        """Search for several topics (topic_id => query) at once, returns (topic_id => results)
+
+        on_feedback is called with each topic's expansion terms and timings of the pseudo-relevance feedback."""
+        self._check_arguments(scoring, prf_docs)
+
+        # the word scores are shared between the topics (if they don't depend on the topic)
+        word_doc_score = {}
+        results = {}
+        for topic_id, query in topics.items():
+            results[topic_id] = self._rank(Counter(self.tokenize(query)), scoring, k1, k3, b, top_k,
+                                           prf_docs, prf_terms, word_doc_score, topic_id, on_feedback)
+        return results
+
+    def search_batch(self, topics: Dict[int, str], scoring: str = "tfidf", k1: float = 1.2, k3: float = 1.2,
+                     b: float = 0.75, top_k: int = 1000, prf_docs: int = 0, prf_terms: int = 10,
+                     batch_size: int = 1000, on_feedback: FeedbackCallback = None) -> Dict[int, List[SearchResult]]:
+        """Like search_many(), but score the topics together via score_batch() - batch_size topics at a time,
+        bounding the memory for their accumulators (the rescoring time of a batch is split evenly between its topics)"""
+        self._check_arguments(scoring, prf_docs)
+
+        word_doc_score = {}
+        results = {}
+        topic_ids = list(topics)
+        for start in range(0, len(topic_ids), batch_size):
+            batch = {topic_id: Counter(self.tokenize(topics[topic_id])) for topic_id in topic_ids[start:start + batch_size]}
+            document_scores = self.score_batch(batch, scoring, k1, k3, b, word_doc_score)
+
+            if prf_docs > 0:
+                # expand every topic with terms from its top documents, then score the batch again
+                expansions = {}  # dict: topic => (expansion terms, expansion time)
+                for topic_id, topic_tf_q in batch.items():
+                    expansion_start = time.perf_counter()
+                    expansion       = self.feedback_terms(document_scores[topic_id], topic_tf_q, prf_docs, prf_terms)
+                    for term in expansion:
+                        topic_tf_q[term] += 1
+                    expansions[topic_id] = (expansion, time.perf_counter() - expansion_start)
+                    self.timings.add("prf_expansion", expansions[topic_id][1])
+
+                rescoring_start = time.perf_counter()
+                document_scores = self.score_batch(batch, scoring, k1, k3, b, word_doc_score)
+                rescoring_time  = (time.perf_counter() - rescoring_start) / len(batch)
+                for topic_id, (expansion, expansion_time) in expansions.items():
+                    self.timings.add("prf_rescoring", rescoring_time)
+                    if on_feedback is not None:
+                        on_feedback(topic_id, expansion, expansion_time, rescoring_time)
+
+            for topic_id in batch:
+                # the accumulators are dropped as soon as possible, they may be large
+                topic_scores = document_scores.pop(topic_id)
+                best = heapq.nlargest(top_k, topic_scores.items(), key=lambda x: x[1])
+                results[topic_id] = [SearchResult(doc_id, self.doc_int_ids[doc_id], score) for (doc_id, score) in best]
+        return results
+
+    def document(self, doc_id: int) -> Document:
+        """Fetch the document from the document store"""
+        if self.doc_store is None:
+            raise ValueError("Fetching documents requires '%s.docs'" % self.index_file)
+
+        start = time.perf_counter()
+        with self.store_lock:
+            doc = self.doc_store.get(doc_id)
+        self.timings.add("doc_fetch", time.perf_counter() - start)
+        return doc
+
+    def snippet(self, doc: Document, query: str) -> str:
+        """Choose the window of the document's text that covers most (distinct) query tokens"""
+        topic_tokens = set(self.tokenize(query))
+        words = markup_re.sub(" ", doc.text).split()
+        if len(words) <= SNIPPET_WORDS:
+            return " ".join(words)
+
+        # the tokens of each word, tokenized like the index
+        matches = [set(self.tokenizer.tokenize(w)) & topic_tokens for w in words]
+
+        best_start = 0
+        best_score = -1
+        for start in range(0, len(words) - SNIPPET_WORDS + 1):
+            window = matches[start:start + SNIPPET_WORDS]
+            # distinct tokens count most, repetitions only break ties
+            score  = len(set().union(*window)) + 0.01 * sum(len(m) for m in window)
+            if score > best_score:
+                best_start = start
+                best_score = score
+
+        snippet = " ".join(words[best_start:best_start + SNIPPET_WORDS])
+        prefix  = "... " if best_start > 0 else ""
+        suffix  = " ..." if best_start + SNIPPET_WORDS < len(words) else ""
+        return prefix + snippet + suffix
+
+
+class SnapshotSearcher:
+    """Keeps a Searcher on the published index snapshot, switching over when a newer one is published
+
+    A new snapshot is loaded in the background while the previous searcher keeps serving,
+    so current() never waits for loading (unless wait=True)."""
+
+    def __init__(self, base: str = ".", max_expansions: int = 50, progress: bool = False,
+                 cache_size: int = None, cache_policy: str = "lru", warm_queries: List[str] = None,
+                 field_weights: Dict[str, float] = None):
+        self.base           = base
+        self.max_expansions = max_expansions
+        self.cache_size     = cache_size
+        self.cache_policy   = cache_policy
+        self.warm_queries   = warm_queries
+        self.field_weights  = field_weights
+        self.lock           = threading.Lock()
+        self.loader         = None
+        self.snapshot       = current_snapshot(base)
+        self.searcher       = self._open(resolve_index(None, base), progress)
+
+    def _open(self, index_file: str, progress: bool = False) -> Searcher:
+        searcher = Searcher(index_file, self.max_expansions, progress, self.cache_size, self.cache_policy,
+                            self.field_weights)
+        if self.warm_queries:
+            searcher.warm(self.warm_queries)
+        return searcher
+
+    def current(self, wait: bool = False) -> Searcher:
+        """Get the searcher for the newest loaded snapshot, starting to load a newly published one"""
+        snapshot = current_snapshot(self.base)
+        with self.lock:
+            if snapshot is not None and snapshot != self.snapshot and self.loader is None:
+                self.loader = threading.Thread(target=self._load, args=(snapshot,), daemon=True)
+                self.loader.start()
+            loader = self.loader
+
+        if wait and loader is not None:
+            loader.join()
+        with self.lock:
+            return self.searcher
+
+    def _load(self, snapshot: str) -> None:
+        searcher = None
+        try:
+            searcher = self._open(os.path.join(snapshot, "index"))
+        except Exception:
+            # e.g. the snapshot was already deleted again or its files are broken,
+            # the next call retries with the newest one
+            pass
+        finally:
+            with self.lock:
+                # the old searcher isn't closed, because other threads may still use it -
+                # its files are released once it's garbage collected
+                if searcher is not None:
+                    self.searcher = searcher
+                    self.snapshot = snapshot
+                self.loader = None
@@ -0,0 +1,99 @@
+import datetime
+import os
+import os.path
+import shutil
+from typing import List, Optional
+
+# every run of the indexer builds its files in a new snapshot directory,
+# which is published by atomically replacing the CURRENT pointer file:
+#   CURRENT                    name of the published snapshot
+#   snapshots/<timestamp>-<pid>/index, index.meta, ...
+SNAPSHOT_DIR = "snapshots"
+CURRENT      = "CURRENT"
+
+
+def new_snapshot(base: str = ".") -> str:
+    """Create a new (unpublished) snapshot directory and return its path"""
+    name = "%s-%d" % (datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f"), os.getpid())
+    path = os.path.join(base, SNAPSHOT_DIR, name)
+    os.makedirs(path)
+    return path
+
+
+def list_snapshots(base: str = ".") -> List[str]:
+    """List the paths of all snapshot directories, from oldest to newest"""
+    snapshot_dir = os.path.join(base, SNAPSHOT_DIR)
+    if not os.path.isdir(snapshot_dir):
+        return []
+    return [os.path.join(snapshot_dir, name) for name in sorted(os.listdir(snapshot_dir))]
+
+
+def current_snapshot(base: str = ".") -> Optional[str]:
+    """Get the path of the published snapshot (None if nothing was published yet)"""
+    pointer = os.path.join(base, CURRENT)
+    if not os.path.isfile(pointer):
+        return None
+
+    with open(pointer) as pointer_file:
+        name = pointer_file.read().strip()
+    return os.path.join(base, SNAPSHOT_DIR, name) if name else None
+
+
+def publish(snapshot: str, base: str = ".") -> None:
+    """Make the snapshot the current one - readers either see the old or the new one, never a mix"""
+    pointer = os.path.join(base, CURRENT)
+    with open(pointer + ".tmp", "w") as pointer_file:
+        pointer_file.write(os.path.basename(snapshot))
+        pointer_file.flush()
+        os.fsync(pointer_file.fileno())
+    os.replace(pointer + ".tmp", pointer)
+
+
+def resolve_index(index_file: str = None, base: str = ".") -> str:
+    """Find the index to use: the explicitly given one, else the published snapshot's, else the plain 'index'"""
+    if index_file is not None:
+        return index_file
+
+    snapshot = current_snapshot(base)
+    if snapshot is not None:
+        return os.path.join(snapshot, "index")
+    return os.path.join(base, "index")
+
+
+def is_complete(snapshot: str) -> bool:
+    """Whether the snapshot was built completely (the meta information is written last, the manifest removed)"""
+    return os.path.isfile(os.path.join(snapshot, "index.meta")) and \
+        not os.path.isfile(os.path.join(snapshot, "index.manifest"))
+
+
+def is_building(snapshot: str) -> bool:
+    """Whether the process that created the snapshot (the pid in its name) is still running"""
+    # psutil is only needed here, so don't import it for every user of the snapshots
+    import psutil
+
+    (_, _, pid) = os.path.basename(snapshot).rpartition("-")
+    return pid.isdigit() and int(pid) != os.getpid() and psutil.pid_exists(int(pid))
+
+
+def collect_garbage(base: str = ".", keep: int = 2) -> List[str]:
+    """Delete the complete snapshots older than the 'keep' newest ones up to the published one,
+    as well as the stale unpublished ones older than it, returns the deleted paths"""
+    current = current_snapshot(base)
+    if current is None:
+        return []
+
+    # unpublished snapshots newer than the current one may still be built (or resumed)
+    snapshots = [s for s in list_snapshots(base) if os.path.basename(s) <= os.path.basename(current)]
+    complete  = [s for s in snapshots if os.path.basename(s) == os.path.basename(current) or is_complete(s)]
+    # only the complete ones count towards 'keep', failed or aborted runs are deleted
+    # (unless they're still being built by a run that was started before the current one)
+    stale     = [s for s in snapshots if s not in complete and not is_building(s)]
+    deleted   = []
+    for snapshot in complete[:max(len(complete) - keep, 0)] + stale:
+        try:
+            shutil.rmtree(snapshot)
+            deleted.append(snapshot)
+        except OSError:
+            # e.g. on Windows, files that are still opened by a search can't be deleted
+            pass
+    return deleted
@@ -0,0 +1,292 @@
+import mmap
+import os.path
+import struct
+import sys
+from array import array
+from typing import Iterator, List, Optional, Tuple
+from util.util import read_token, read_varint, write_varint
+
+# layout of a dictionary file:
+#   header:  magic, term count, block size, block count
+#   offsets: one uint64 per block (relative to the start of the data section)
+#   values:  one uint64 per term (e.g. the byte offset of the term's line in the index)
+#   data:    front-coded blocks; the first term of each block is stored completely,
+#            every following term as (length of shared prefix, suffix)
+MAGIC      = b"FCD1"
+HEADER     = struct.Struct("<4sIII")
+BLOCK_SIZE = 16
+
+
+def _common_prefix_len(one: bytes, other: bytes) -> int:
+    """Calculate the length of the common prefix of both byte strings"""
+    max_len = min(len(one), len(other))
+    i = 0
+    while i < max_len and one[i] == other[i]:
+        i += 1
+    return i
+
+
+class FrontCodedDictionaryWriter:
+    """Writes a sorted list of terms (with one integer value each) as front-coded dictionary"""
+
+    def __init__(self, file_name: str, block_size: int = BLOCK_SIZE):
+        self.file_name  = file_name
+        self.block_size = block_size
+        self.data       = bytearray()
+        self.offsets    = array("Q")
+        self.values     = array("Q")
+        self.last_term  = None
+
+    def add(self, term: str, value: int) -> None:
+        """Add the next term - terms have to be added in ascending order"""
+        term_bytes = term.encode("utf8")
+        if self.last_term is not None and term_bytes <= self.last_term:
+            raise ValueError("Terms must be added in ascending order: '%s'" % term)
+
+        if len(self.values) % self.block_size == 0:
+            # start a new block with the full term
+            self.offsets.append(len(self.data))
+            write_varint(self.data, len(term_bytes))
+            self.data += term_bytes
+        else:
+            shared = _common_prefix_len(self.last_term, term_bytes)
+            write_varint(self.data, shared)
+            write_varint(self.data, len(term_bytes) - shared)
+            self.data += term_bytes[shared:]
+
+        self.values.append(value)
+        self.last_term = term_bytes
+
+    def close(self) -> None:
+        """Write the dictionary to the file"""
+        with open(self.file_name, "wb") as out_file:
+            out_file.write(HEADER.pack(MAGIC, len(self.values), self.block_size, len(self.offsets)))
+            out_file.write(self.offsets.tobytes())
+            out_file.write(self.values.tobytes())
+            out_file.write(self.data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+
+class FrontCodedDictionary:
+    """Memory-mapped, read-only front-coded term dictionary"""
+
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+        self.file      = open(file_name, "rb")
+        self.mmap      = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, term_count, block_size, block_count) = HEADER.unpack_from(self.mmap, 0)
+        if magic != MAGIC:
+            raise ValueError("'%s' is not a term dictionary file" % file_name)
+
+        self.term_count  = term_count
+        self.block_size  = block_size
+        self.block_count = block_count
+
+        view          = memoryview(self.mmap)
+        offsets_start = HEADER.size
+        values_start  = offsets_start + 8 * block_count
+        self.data_pos = values_start + 8 * term_count
+        self.offsets  = view[offsets_start:values_start].cast("Q")
+        self.values   = view[values_start:self.data_pos].cast("Q")
+
+    def close(self) -> None:
+        # the memoryviews have to be released before the mmap can be closed
+        self.offsets.release()
+        self.values.release()
+        self.mmap.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self) -> int:
+        return self.term_count
+
+    def __contains__(self, term: str) -> bool:
+        return self.lookup(term) is not None
+
+    def _first_term(self, block: int) -> bytes:
+        """Decode the (fully stored) first term of the block"""
+        pos = self.data_pos + self.offsets[block]
+        (length, pos) = read_varint(self.mmap, pos)
+        return self.mmap[pos:pos + length]
+
+    def _iter_from_block(self, block: int) -> Iterator[Tuple[int, bytes]]:
+        """Decode the terms from the start of the block until the end of the dictionary"""
+        buf = self.mmap
+        for current_block in range(block, self.block_count):
+            ordinal = current_block * self.block_size
+            end     = min(ordinal + self.block_size, self.term_count)
+            pos     = self.data_pos + self.offsets[current_block]
+            (length, pos) = read_varint(buf, pos)
+            term = buf[pos:pos + length]
+            pos += length
+            yield (ordinal, term)
+            ordinal += 1
+
+            # the rest of the block is front-coded against the previous term
+            while ordinal < end:
+                (shared, pos) = read_varint(buf, pos)
+                (length, pos) = read_varint(buf, pos)
+                term = term[:shared] + buf[pos:pos + length]
+                pos += length
+                yield (ordinal, term)
+                ordinal += 1
+
+    def _find_block(self, term: bytes) -> int:
+        """Find the last block whose first term is not greater than the term"""
+        lo = 0
+        hi = self.block_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._first_term(mid) <= term:
+                lo = mid + 1
+            else:
+                hi = mid
+        return max(lo - 1, 0)
+
+    def lookup(self, term: str) -> Optional[int]:
+        """Look up the ordinal (term ID) of the term, or None if it is not contained"""
+        if not self.term_count:
+            return None
+
+        term_bytes = term.encode("utf8")
+        block      = self._find_block(term_bytes)
+        end        = (block + 1) * self.block_size
+        for (ordinal, candidate) in self._iter_from_block(block):
+            if candidate == term_bytes:
+                return ordinal
+            if candidate > term_bytes or ordinal + 1 >= end:
+                break
+        return None
+
+    def get(self, term: str, default: int = None) -> Optional[int]:
+        """Look up the value stored for the term"""
+        ordinal = self.lookup(term)
+        if ordinal is None:
+            return default
+        return self.values[ordinal]
+
+    def value(self, ordinal: int) -> int:
+        """Get the value stored for the term with the specified ordinal"""
+        return self.values[ordinal]
+
+    def term_at(self, ordinal: int) -> str:
+        """Get the term with the specified ordinal"""
+        if not 0 <= ordinal < self.term_count:
+            raise IndexError("Term ordinal out of range: %d" % ordinal)
+
+        for (current, term) in self._iter_from_block(ordinal // self.block_size):
+            if current == ordinal:
+                return term.decode("utf8")
+
+    def prefix(self, prefix: str) -> Iterator[Tuple[str, int]]:
+        """Enumerate all (term, value) pairs of terms starting with the prefix, in sorted order"""
+        if not self.term_count:
+            return
+
+        prefix_bytes = prefix.encode("utf8")
+        for (ordinal, term) in self._iter_from_block(self._find_block(prefix_bytes)):
+            if term.startswith(prefix_bytes):
+                yield (term.decode("utf8"), self.values[ordinal])
+            elif term > prefix_bytes:
+                break
+
+    def expand(self, pattern: str, limit: int = None) -> List[str]:
+        """Expand a query term with an optional trailing wildcard ('econom*') into the matching terms"""
+        if not pattern.endswith("*"):
+            return [pattern] if pattern in self else []
+
+        terms = []
+        for (term, _) in self.prefix(pattern.rstrip("*")):
+            if limit is not None and len(terms) >= limit:
+                break
+            terms.append(term)
+        return terms
+
+
+def build_term_dictionary(index_file: str, dict_file: str) -> int:
+    """Create a term dictionary for the (sorted) index, storing the byte offset of each term's line"""
+    count = 0
+    with open(index_file, "rb") as idx_file, FrontCodedDictionaryWriter(dict_file) as writer:
+        offset = 0
+        for line in idx_file:
+            if line.strip():
+                writer.add(read_token(line.decode("utf8")), offset)
+                count += 1
+            offset += len(line)
+    return count
+
+
+# if the module is executed directly (python -m util.termdict, from within src),
+# it compares the dictionary against a python dict
+if __name__ == "__main__":
+    import random
+    import string
+    import tempfile
+    import time
+    import tracemalloc
+    from util.util import PostingsListItem
+
+    no_terms = int(sys.argv[1]) if sys.argv[1:] else 1000000
+    rnd      = random.Random(42)
+    terms    = set()
+    while len(terms) < no_terms:
+        length = rnd.randint(3, 12)
+        terms.add("".join(rnd.choice(string.ascii_lowercase) for _ in range(length)))
+    terms = sorted(terms)
+    probes = [rnd.choice(terms) for _ in range(100000)]
+
+    print("Vocabulary: %d terms" % no_terms)
+
+    # the current representation: {token: PostingsListItem}
+    tracemalloc.start()
+    python_dict = {t: PostingsListItem(t, []) for t in terms}
+    (dict_mem, _) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for p in probes:
+        python_dict.get(p)
+    dict_lookup = (time.perf_counter() - start) / len(probes)
+    del python_dict
+
+    dict_file = os.path.join(tempfile.mkdtemp(), "index.dict")
+    with FrontCodedDictionaryWriter(dict_file) as writer:
+        for (i, t) in enumerate(terms):
+            writer.add(t, i)
+
+    tracemalloc.start()
+    fcd = FrontCodedDictionary(dict_file)
+    (fcd_mem, _) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for p in probes:
+        assert fcd.get(p) is not None
+    fcd_lookup = (time.perf_counter() - start) / len(probes)
+
+    start = time.perf_counter()
+    expanded = 0
+    for p in probes[:10000]:
+        expanded += len(fcd.expand(p[:3] + "*"))
+    fcd_prefix = (time.perf_counter() - start) / 10000
+
+    file_size = os.path.getsize(dict_file)
+    print("dict[str, PostingsListItem]: %8.2f MB heap (%6.1f B/term), lookup %6.2f us"
+          % (dict_mem / 2**20, dict_mem / no_terms, dict_lookup * 1e6))
+    print("FrontCodedDictionary       : %8.2f MB file (%6.1f B/term), %d B heap, lookup %6.2f us"
+          % (file_size / 2**20, file_size / no_terms, fcd_mem, fcd_lookup * 1e6))
+    print("3-letter wildcard expansion: %6.2f us (%.1f terms on average)"
+          % (fcd_prefix * 1e6, expanded / 10000))
+    fcd.close()
@@ -1,22 +1,50 @@
 import re
-import nltk
 import os.path
 from typing import List
-from nltk.stem import WordNetLemmatizer
-from nltk.stem.snowball import EnglishStemmer
 
+# the NLP resources are only loaded when they are actually needed,
+# because importing nltk alone takes a considerable amount of time
+_lemmatizer = None
+_stemmer = None
+_stop_words_list = None
 
-# required for the wordnet lemmatizer
-nltk.download("wordnet")
-lemmatizer = WordNetLemmatizer()
-stemmer    = EnglishStemmer(ignore_stopwords=False)
-stop_words_list = []
-
-# fetch the saved list of stopwords
+# the saved list of stopwords
 _dir = os.path.dirname(__file__)
 stopwords_file = os.path.join(_dir, "stopwords")
-with open(stopwords_file) as swf:
-    stop_words_list = [w.strip() for w in swf.readlines()]
+
+
+def get_stemmer():
+    """Create the (shared) snowball stemmer on first use"""
+    global _stemmer
+    if _stemmer is None:
+        from nltk.stem.snowball import EnglishStemmer
+        _stemmer = EnglishStemmer(ignore_stopwords=False)
+    return _stemmer
+
+
+def get_lemmatizer():
+    """Create the (shared) wordnet lemmatizer on first use - the wordnet corpus is never downloaded implicitly"""
+    global _lemmatizer
+    if _lemmatizer is None:
+        from nltk.stem import WordNetLemmatizer
+        lemmatizer = WordNetLemmatizer()
+        try:
+            # the corpus is loaded lazily by nltk, so we force it here to fail early
+            lemmatizer.lemmatize("test")
+        except LookupError:
+            raise LookupError("Lemmatization requires the wordnet corpus, "
+                              "install it once via: python -m nltk.downloader wordnet")
+        _lemmatizer = lemmatizer
+    return _lemmatizer
+
+
+def get_stop_words() -> List[str]:
+    """Read the saved list of stopwords on first use"""
+    global _stop_words_list
+    if _stop_words_list is None:
+        with open(stopwords_file) as swf:
+            _stop_words_list = [w.strip() for w in swf.readlines()]
+    return _stop_words_list
 
 
 def delete_specials(word: str) -> str:
@@ -40,7 +68,12 @@ class Tokenizer:
         self.stemming = stemming
         self.lemmatization = lemmatization
         self.stop_words_list = [] if stop_word_list is None else stop_word_list
-        self.stop_words_list = stop_words_list + self.stop_words_list
+        if stop_words:
+            self.stop_words_list = get_stop_words() + self.stop_words_list
+
+        # only load the resources for the enabled options
+        self.stemmer = get_stemmer() if stemming else None
+        self.lemmatizer = get_lemmatizer() if lemmatization else None
 
 
     def tokenize(self, document: str) -> List[str]:
@@ -57,12 +90,12 @@ class Tokenizer:
                     continue
                 
             if self.stemming:
-                t = stemmer.stem(t)
+                t = self.stemmer.stem(t)
                 
             if self.lemmatization:
                 # has additional parameter pos='n'
                 # that specifies type of token (e.g. Noun, Verb, ...)
-                t = lemmatizer.lemmatize(t)
+                t = self.lemmatizer.lemmatize(t)
 
             if self.stop_words:
                 if t in self.stop_words_list:
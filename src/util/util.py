@@ -1,6 +1,72 @@
+import multiprocessing
+import os
 import os.path
-from json import JSONEncoder, loads, dumps
-from typing import List, Dict
+import shutil
+from array import array
+from bisect import bisect_left
+from itertools import chain
+from json import JSONDecoder, JSONEncoder, loads, dumps
+from json.decoder import scanstring
+from typing import List, Dict, Tuple
+
+# the fields indexed besides the text (with --fields), in the order of their postings in the blocks
+FIELDS = ["headline"]
+
+# the first JSON object of an index line is decoded on its own, because the line
+# may continue with a tab and the per-field postings (only with --fields)
+decoder = JSONDecoder()
+
+
+def write_varint(buf: bytearray, number: int) -> None:
+    """Append the number as variable-length integer (7 bits per byte) to the buffer"""
+    while number >= 0x80:
+        buf.append((number & 0x7F) | 0x80)
+        number >>= 7
+    buf.append(number)
+
+
+def read_varint(buf, pos: int) -> Tuple[int, int]:
+    """Read a variable-length integer from the buffer, returns (number, new position)"""
+    number = 0
+    shift  = 0
+    while True:
+        byte    = buf[pos]
+        pos    += 1
+        number |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return (number, pos)
+        shift += 7
+
+
+def encode_postings(pli) -> bytes:
+    """Encode the postings in a gap-compressed format: count, doc ID gaps, then the occurrence counts"""
+    buf  = bytearray()
+    docs = sorted(pli.occurrences)
+    write_varint(buf, len(docs))
+    last = 0
+    for doc in docs:
+        write_varint(buf, doc - last)
+        last = doc
+    for doc in docs:
+        write_varint(buf, pli.occurrences[doc])
+    return bytes(buf)
+
+
+def decode_postings(buf, pos: int = 0) -> Tuple[List[int], List[int]]:
+    """Decode gap-compressed postings, returns (doc IDs, occurrence counts)"""
+    (count, pos) = read_varint(buf, pos)
+    docs = []
+    last = 0
+    for _ in range(count):
+        (gap, pos) = read_varint(buf, pos)
+        last += gap
+        docs.append(last)
+    tfs = []
+    for _ in range(count):
+        (tf, pos) = read_varint(buf, pos)
+        tfs.append(tf)
+    return (docs, tfs)
+
 
 class IndexMeta:
     """Store for meta information about the Index"""
@@ -13,7 +79,10 @@ class IndexMeta:
                  case_folding=False,
                  stop_words=False,
                  lemmatization=False,
-                 stemming=False):
+                 stemming=False,
+                 field_lengths=None,
+                 document_frequencies=None,
+                 combined_document_frequencies=None):
 
         self.document_lengths = document_lengths
         self.document_set_lengths = document_set_lengths
@@ -24,6 +93,62 @@ class IndexMeta:
         self.stop_words = stop_words
         self.lemmatization = lemmatization
         self.stemming = stemming
+        # field => lengths of the documents' field (only for the fields besides the text)
+        self.field_lengths = field_lengths or {}
+        # token => df before pruning, only for the terms that lost postings (text, respectively any field)
+        self.document_frequencies = document_frequencies or {}
+        self.combined_document_frequencies = combined_document_frequencies or {}
+
+
+class Vocabulary:
+    """Interns the tokens as integer term IDs, in the order of their first occurrence"""
+
+    def __init__(self, tokens: List[str] = ()):
+        self.tokens  = list(tokens)
+        self.ids     = {token: term_id for term_id, token in enumerate(self.tokens)}
+        self._ranks  = None
+
+    def __len__(self) -> int:
+        return len(self.tokens)
+
+    def intern(self, token: str) -> int:
+        """Get the term ID of the token, assigning the next free one to new tokens"""
+        term_id = self.ids.get(token)
+        if term_id is None:
+            term_id = len(self.tokens)
+            self.ids[token] = term_id
+            self.tokens.append(token)
+            self._ranks = None
+        return term_id
+
+    def token(self, term_id: int) -> str:
+        return self.tokens[term_id]
+
+    def ranks(self) -> array:
+        """Position of every term ID's token in the sorted vocabulary (i.e. its line in the final index)"""
+        if self._ranks is None:
+            self._ranks = array("I", [0]) * len(self.tokens)
+            for rank, term_id in enumerate(sorted(range(len(self.tokens)), key=self.tokens.__getitem__)):
+                self._ranks[term_id] = rank
+        return self._ranks
+
+    def save(self, file_name: str) -> None:
+        """Write the tokens (one JSON string per line, ordered by term ID), replacing the file atomically"""
+        with open(file_name + ".tmp", "w") as vocab_file:
+            for token in self.tokens:
+                vocab_file.write("%s\n" % dumps(token))
+        os.replace(file_name + ".tmp", file_name)
+
+    @staticmethod
+    def load(file_name: str, count: int = None):
+        """Read the (first count) tokens of a saved vocabulary"""
+        tokens = []
+        with open(file_name, "r") as vocab_file:
+            for line in vocab_file:
+                if count is not None and len(tokens) >= count:
+                    break
+                tokens.append(loads(line))
+        return Vocabulary(tokens)
 
 
 class PostingsListItem:
@@ -32,6 +157,8 @@ class PostingsListItem:
     def __init__(self, token: str, doc_list: List[int]):
         self.token = token
         self.occurrences = {}
+        # the occurrences per field (besides the text) as undecoded JSON, only decoded on demand
+        self.field_section = None
 
         for doc in doc_list:
             self.add_doc(doc)
@@ -54,10 +181,22 @@ class PostingsListItem:
         else:
             self.occurrences[document] = 1
 
+    def field_occurrences(self) -> Dict[str, Dict[int, int]]:
+        """Decode the occurrences per field (field => {doc => count}), empty if the index has no fields"""
+        if self.field_section is None:
+            return {}
+        return {field: {int(doc): cnt for doc, cnt in occurrences.items()}
+                for field, occurrences in loads(self.field_section).items()}
+
+    def set_field_occurrences(self, fields: Dict[str, Dict[int, int]]) -> None:
+        """Replace the occurrences per field (fields without occurrences are left out)"""
+        fields = {field: occurrences for field, occurrences in fields.items() if occurrences}
+        self.field_section = dumps(fields) if fields else None
+
     @staticmethod
     def from_json(json_string):
         """Create a PLI object from a JSON string"""
-        json_object = loads(json_string)
+        (json_object, end) = decoder.raw_decode(json_string)
 
         if len(json_object) != 1:
             return None
@@ -67,10 +206,14 @@ class PostingsListItem:
         for doc, cnt in json_object[token].items():
             pli.occurrences[int(doc)] = cnt
 
+        if end < len(json_string) and json_string[end] == "\t":
+            pli.field_section = json_string[end + 1:].strip()
         return pli
 
     def to_json(self):
         """Create a JSON string from the PostingsListItem"""
+        if self.field_section is not None:
+            return "%s\t%s" % (dumps(self, cls=PLIEncoder), self.field_section)
         return dumps(self, cls=PLIEncoder)
 
     @staticmethod
@@ -92,6 +235,58 @@ class PostingsListItem:
         return rep
 
 
+class CompactPostings:
+    """Memory-efficient alternative to the PostingsListItem for building blocks
+
+    The documents have to be added in ascending order (as they are during SPIMI),
+    such that the postings can be kept in two parallel arrays of doc IDs and counts
+    instead of a dictionary."""
+    __slots__ = ("term_id", "docs", "tfs")
+
+    def __init__(self, term_id: int, doc_list: List[int] = ()):
+        self.term_id = term_id
+        self.docs  = array("I")
+        self.tfs   = array("I")
+
+        for doc in doc_list:
+            self.add_doc(doc)
+
+    def count(self) -> int:
+        """Return the document frequency"""
+        return len(self.docs)
+
+    def occurrences_in(self, document: int) -> int:
+        """Check how often the term occurs in the specified document"""
+        pos = bisect_left(self.docs, document)
+        if pos < len(self.docs) and self.docs[pos] == document:
+            return self.tfs[pos]
+        return 0
+
+    def add_doc(self, document: int) -> None:
+        """Increase count of occurrences of the item in document"""
+        if self.docs and self.docs[-1] == document:
+            self.tfs[-1] += 1
+        elif self.docs and self.docs[-1] > document:
+            raise ValueError("Documents must be added in ascending order: %d" % document)
+        else:
+            self.docs.append(document)
+            self.tfs.append(1)
+
+    def to_block_line(self, field_postings: List = ()) -> str:
+        """Create a block line 'term_id doc tf doc tf ...',
+        followed by a tab and 'doc tf ...' for each of the field postings (None if the term isn't in the field)"""
+        line = "%d %s" % (self.term_id, " ".join(map(str, chain.from_iterable(zip(self.docs, self.tfs)))))
+        for postings in field_postings:
+            line += "\t"
+            if postings is not None:
+                line += " ".join(map(str, chain.from_iterable(zip(postings.docs, postings.tfs))))
+        return line
+
+    def __str__(self) -> str:
+        rep = "(%s, %s): %s" % (self.term_id, self.count(), list(self.docs))
+        return rep
+
+
 class PLIEncoder(JSONEncoder):
     """JSON Encoder for PostingsListItems"""
     def default(self, o):
@@ -154,26 +349,84 @@ def __merge_items(first, second):
     return (pli, first[1])
 
 
+def read_token(line: str) -> str:
+    """Decode only the token of a JSON-serialized PostingsListItem"""
+    # every line looks like {"token": {...}}, so the token's string starts at index 2
+    (token, _) = scanstring(line, 2)
+    return token
+
+
+def block_line_key(ranks: array, line: str) -> int:
+    """Rank (position in the sorted vocabulary) of the term of a block line"""
+    return ranks[int(line[:line.index(" ")])]
+
+
+def seek_key(file_name: str, target, line_key) -> int:
+    """Find the byte offset of the first line in the (sorted!) file whose key is not smaller than the target"""
+    def first_key_after(src, pos):
+        # the key of the first complete line starting at or after pos (None at EOF)
+        src.seek(pos)
+        if pos > 0:
+            src.readline()
+        line = src.readline()
+        return line_key(line.decode("utf8")) if line.strip() else None
+
+    with open(file_name, "rb") as src:
+        # binary search for the first position whose following line is not smaller
+        lo = 0
+        hi = os.path.getsize(file_name)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            found = first_key_after(src, mid)
+            if found is None or found >= target:
+                hi = mid
+            else:
+                lo = mid + 1
+
+        # the line following lo - 1 is still smaller, so we only need to scan a few lines
+        pos = max(lo - 1, 0)
+        src.seek(pos)
+        if pos > 0:
+            src.readline()
+        while True:
+            pos  = src.tell()
+            line = src.readline()
+            if not line.strip() or line_key(line.decode("utf8")) >= target:
+                return pos
+
+
 class SourcedQueue:
-    """A Queue drawing its items from several (sorted!) source files"""
+    """A Queue drawing its items from several (sorted!) block files
+
+    The items are tuples (rank, number of the source, term ID, postings as 'doc tf doc tf ...'),
+    so equal terms are dequeued in the order of the blocks - and thus with ascending documents."""
 
-    def __init__(self, source_files, buffer_len=100):
+    def __init__(self, source_files, vocabulary, buffer_len=100, first_rank=None, last_rank=None):
         # source_files: list of file names
         # sources:      {FILE_NAME: FILE_OBJECT}
         # source_open:  {FILE_NAME: BOOLEAN}
         # source_items: {FILE_NAME: COUNT OF ITEMS IN THE QUEUE FROM THIS SOURCE}
+        # first_rank, last_rank: only terms with ranks in the range [first_rank, last_rank) are drawn
         self.source_files = source_files
         self.sources      = {}
         self.source_open  = {}
         self.source_items = {}
-        self.queue        = PriorityQueue(key=lambda x: x[0].token)
+        self.source_no    = {}
+        self.ranks        = vocabulary.ranks()
+        self.queue        = PriorityQueue()
         self.buffer       = buffer_len
-        
-        for src_file in source_files:
+        self.last_rank    = last_rank
+
+        for src_no, src_file in enumerate(source_files):
             # open the source files and populate the variables
             self.sources[src_file]      = open(src_file, "r")
             self.source_open[src_file]  = True
             self.source_items[src_file] = 0
+            self.source_no[src_file]    = src_no
+
+            if first_rank is not None:
+                # skip everything before the range
+                self.sources[src_file].seek(seek_key(src_file, first_rank, lambda l: block_line_key(self.ranks, l)))
 
         for src_name in self.sources:
             # from each source file, read as much as we want to buffer
@@ -186,23 +439,23 @@ class SourcedQueue:
         if not self.source_open[source_name]:
             # if the source_file is closed already, do nothing
             return False
-        
+
         # read a line from the source file
-        src = self.sources[source_name]
+        src  = self.sources[source_name]
         line = src.readline()
-        
-        if not line:
-            # if we hit EOF, close the file
+        if line:
+            (term_id, postings) = line.rstrip("\n").split(" ", 1)
+            term_id = int(term_id)
+            rank    = self.ranks[term_id]
+
+        if not line or (self.last_rank is not None and rank >= self.last_rank):
+            # if we hit EOF (or the end of our range), close the file
             self.source_open[source_name] = False
             src.close()
             return False
-        
-        # parse the PLI and insert it in the queue
-        # and increment the counter of items per source
-        # > might use the merge=merge_items parameter of insert()
-        # > but merging on dequeue() is easier
-        pli = PostingsListItem.from_json(line)
-        self.queue.insert((pli, source_name))
+
+        # only the term ID is decoded, the postings are merged as they are
+        self.queue.insert((rank, self.source_no[source_name], term_id, postings))
         self.source_items[source_name] += 1
         return True
 
@@ -211,7 +464,8 @@ class SourcedQueue:
         if not self.queue.empty():
             # pop the queue's front-most item and decrease
             # counter for the respective source
-            (item, source_name) = self.queue.pop()
+            item = self.queue.pop()
+            source_name = self.source_files[item[1]]
             self.source_items[source_name] -= 1
 
             if self.source_items[source_name] <= 0:
@@ -220,7 +474,7 @@ class SourcedQueue:
                 for i in range(self.buffer):
                     if not self.enqueue(source_name):
                         break
-            
+
             return item
 
         else:
@@ -228,35 +482,126 @@ class SourcedQueue:
             return None
 
 
-def merge_blocks(input_files:List[str], output_file:str, in_buffer_sz:int=100, out_buffer_sz:int=100) -> int:
-    """Merge several index blocks into one single index block, as in SPIMI"""
-    sq = SourcedQueue(input_files)
+def pairs_json(block_postings: List[str]) -> str:
+    """Join the blocks' postings ('doc tf doc tf ...') into the JSON object {"doc": tf, ...}"""
+    parts = " ".join(p for p in block_postings if p).split(" ")
+    return "{%s}" % ", ".join('"%s": %s' % pair for pair in zip(parts[0::2], parts[1::2]))
+
+
+def postings_json(token: str, block_postings: List[str], fields: List[str] = ()) -> str:
+    """Create the index line (in the same format as the PostingsListItem's JSON) from the blocks' postings,
+    which are followed by the tab-separated postings of the fields"""
+    if not fields:
+        return "{%s: %s}" % (dumps(token), pairs_json(block_postings))
+
+    # the lines of a term's blocks, split up into the text and the fields
+    sections = [p.split("\t") for p in block_postings]
+    line     = "{%s: %s}" % (dumps(token), pairs_json([s[0] for s in sections]))
+    field_section = ", ".join("%s: %s" % (dumps(field), pairs_json([s[no] for s in sections if len(s) > no]))
+                              for no, field in enumerate(fields, 1)
+                              if any(len(s) > no and s[no] for s in sections))
+    return "%s\t{%s}" % (line, field_section) if field_section else line
+
+
+def merge_blocks(input_files:List[str], output_file:str, vocabulary, in_buffer_sz:int=100, out_buffer_sz:int=100,
+                 first_rank:int=None, last_rank:int=None, fields:List[str]=()) -> int:
+    """Merge several index blocks into one single index, as in SPIMI"""
+    sq = SourcedQueue(input_files, vocabulary, in_buffer_sz, first_rank, last_rank)
 
     item_count = 0
     with open(output_file, "w") as out_file:
         item     = sq.dequeue()
+        postings = []
         old_item = None
 
         while item is not None:
-            if old_item is not None and old_item.token == item.token:
-                # if the old item had the same token, then we must merge them both
-                item = PostingsListItem.combine(item, old_item)
-
-            elif old_item is not None:
+            if old_item is not None and old_item[0] != item[0]:
                 # if the old item was something different, we can safely print it
-                out_file.write("%s\n" % old_item.to_json())
+                out_file.write("%s\n" % postings_json(vocabulary.token(old_item[2]), postings, fields))
                 item_count += 1
+                postings = []
 
+            # the blocks' documents are disjoint and ascending, so merging is just appending
+            postings.append(item[3])
             old_item = item
             item = sq.dequeue()
         else:
-            # the last item might not have been printed (if it was the same as the previous ones...)
+            # the last item hasn't been printed yet
             if old_item is not None:
-                out_file.write("%s\n" % old_item.to_json())
+                out_file.write("%s\n" % postings_json(vocabulary.token(old_item[2]), postings, fields))
                 item_count += 1
     return item_count
 
 
+def sample_split_points(input_files:List[str], vocabulary, partitions:int, samples_per_file:int=100) -> List[int]:
+    """Choose ranks that split the (sorted!) blocks into term ranges with roughly equal amounts of data"""
+    ranks   = vocabulary.ranks()
+    samples = []
+    for input_file in input_files:
+        size = os.path.getsize(input_file)
+        with open(input_file, "rb") as src:
+            # sample the lines at evenly distributed byte positions,
+            # such that the ranges are balanced by size rather than by number of terms
+            for i in range(samples_per_file):
+                src.seek(size * i // samples_per_file)
+                if i > 0:
+                    src.readline()
+                line = src.readline()
+                if line.strip():
+                    samples.append(block_line_key(ranks, line.decode("utf8")))
+
+    samples.sort()
+    split_points = []
+    for i in range(1, partitions):
+        if not samples:
+            break
+        rank = samples[len(samples) * i // partitions]
+        if not split_points or rank > split_points[-1]:
+            split_points.append(rank)
+    return split_points
+
+
+# the vocabulary of the parallel merge, inherited by the forked worker processes
+_merge_vocabulary = None
+
+
+def _init_merge_worker(vocabulary) -> None:
+    global _merge_vocabulary
+    _merge_vocabulary = vocabulary
+
+
+def _merge_range(input_files:List[str], output_file:str, first_rank:int, last_rank:int, fields:List[str]) -> int:
+    return merge_blocks(input_files, output_file, _merge_vocabulary, first_rank=first_rank, last_rank=last_rank,
+                        fields=fields)
+
+
+def merge_blocks_parallel(input_files:List[str], output_file:str, vocabulary, processes:int, fields:List[str]=()) -> int:
+    """Merge several index blocks into one, merging disjoint term ranges in separate processes"""
+    if processes <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+        # the indexer is a script without __main__ guard, so it must not be re-imported
+        # by the 'spawn' start method (Windows) -> merge sequentially instead
+        return merge_blocks(input_files, output_file, vocabulary, fields=fields)
+
+    # use more ranges than processes, such that uneven ranges are balanced out
+    split_points = sample_split_points(input_files, vocabulary, processes * 4)
+    bounds       = [None] + split_points + [None]
+    range_files  = ["%s.range-%d" % (output_file, i) for i in range(len(bounds) - 1)]
+    jobs         = [(input_files, range_files[i], bounds[i], bounds[i + 1], fields) for i in range(len(bounds) - 1)]
+
+    # with 'fork', the vocabulary (including its ranks) is inherited instead of being pickled for every job
+    with multiprocessing.get_context("fork").Pool(processes, _init_merge_worker, (vocabulary,)) as pool:
+        counts = pool.starmap(_merge_range, jobs)
+
+    # the ranges are disjoint and ordered, so the index is just their concatenation
+    with open(output_file, "wb") as out_file:
+        for range_file in range_files:
+            with open(range_file, "rb") as in_file:
+                shutil.copyfileobj(in_file, out_file)
+            os.remove(range_file)
+
+    return sum(counts)
+
+
 if __name__ == "__main__":
     # tests for the priority queue
     